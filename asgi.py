@@ -0,0 +1,6 @@
+"""
+ASGI entry point for the async serving mode, e.g. `hypercorn asgi:app`.
+"""
+from build_web.async_serving import create_async_app
+
+app = create_async_app()
@@ -0,0 +1,300 @@
+"""
+Ad-hoc asset queries over the columnar build table.
+
+Filter expressions are parsed into a small AST and evaluated as NumPy boolean
+masks over the asset rows, e.g.
+
+    is_internal and suffix == ".prefab" and size > 1MB and group ~ "Effect_*"
+    path ^= "Assets/Res/UI/" and not label in ("Internal", "Base")
+
+Columns: path, suffix, group, bundle, label, dlc_group, size, bundle_size, is_internal.
+Operators: == != > >= < <=, ~ (glob match), ^= (prefix), in (...), and/or/not.
+"""
+import bisect
+import fnmatch
+import re
+import numpy as np
+
+SIZE_UNITS = {"B": 1, "KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3}
+
+STRING_COLUMNS = {"path": "path", "suffix": "suffix", "group": "group", "bundle": "bundle_name"}
+LIST_COLUMNS = {"label": ("label", "label"), "dlc_group": ("dlc", "dlc_group")}
+NUMBER_COLUMNS = ("size", "bundle_size")
+BOOL_COLUMNS = ("is_internal",)
+GROUP_BY_COLUMNS = ("path", "suffix", "group", "bundle", "is_internal")
+SORT_COLUMNS = ("path", "suffix", "group", "bundle", "size", "bundle_size", "is_internal")
+
+TOKEN_PATTERN = re.compile(r"""
+    \s*(?:
+        (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+      | (?P<number>\d+(?:\.\d+)?(?:[KMG]?B)?)
+      | (?P<op>==|!=|>=|<=|\^=|>|<|~|\(|\)|,)
+      | (?P<word>[A-Za-z_][A-Za-z0-9_.\-*/]*)
+    )""", re.VERBOSE | re.IGNORECASE)
+
+
+class QueryError(ValueError):
+    """Invalid query expression or parameter"""
+
+
+def tokenize(text: str):
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        match = TOKEN_PATTERN.match(text, pos)
+        if not match or match.end() == pos:
+            raise QueryError(f"Unexpected character at {pos}: {text[pos:pos + 10]!r}")
+        pos = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "string":
+            value = re.sub(r"\\(.)", r"\1", value[1:-1])
+        elif kind == "number":
+            value = parse_size(value)
+        elif kind == "word" and value.lower() in ("and", "or", "not", "in", "true", "false"):
+            kind, value = "keyword", value.lower()
+        tokens.append((kind, value))
+    return tokens
+
+
+def parse_size(text: str):
+    """Parse number with optional size unit, e.g. 1.5MB"""
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([KMG]?B)?", text.strip(), re.IGNORECASE)
+    if not match:
+        raise QueryError(f"Invalid number: {text}")
+    return int(float(match.group(1)) * SIZE_UNITS[(match.group(2) or "B").upper()])
+
+
+class FilterParser(object):
+    """Recursive descent parser producing nested tuples:
+    ("and", a, b) / ("or", a, b) / ("not", a) / ("cmp", column, op, value)"""
+    def __init__(self, text: str):
+        self.tokens = tokenize(text)
+        self.pos = 0
+
+    def parse(self):
+        if not self.tokens:
+            return None
+        node = self.parse_or()
+        if self.pos != len(self.tokens):
+            raise QueryError(f"Unexpected token: {self.tokens[self.pos][1]}")
+        return node
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self, kind=None, value=None):
+        token = self.peek()
+        if token[0] is None or (kind and token[0] != kind) or (value and token[1] != value):
+            got = "end of filter" if token[0] is None else token[1]
+            raise QueryError(f"Expected {value or kind or 'value'}, got {got}")
+        self.pos += 1
+        return token
+
+    def parse_or(self):
+        node = self.parse_and()
+        while self.peek() == ("keyword", "or"):
+            self.take()
+            node = ("or", node, self.parse_and())
+        return node
+
+    def parse_and(self):
+        node = self.parse_not()
+        while self.peek() == ("keyword", "and"):
+            self.take()
+            node = ("and", node, self.parse_not())
+        return node
+
+    def parse_not(self):
+        if self.peek() == ("keyword", "not"):
+            self.take()
+            return ("not", self.parse_not())
+        if self.peek() == ("op", "("):
+            self.take()
+            node = self.parse_or()
+            self.take("op", ")")
+            return node
+        return self.parse_comparison()
+
+    def parse_comparison(self):
+        _, column = self.take("word")
+        column = column.lower()
+        kind, op = self.peek()
+        if column in BOOL_COLUMNS and (kind is None or op not in ("==", "!=")):
+            # 布尔列可以直接作为条件: "is_internal"
+            return ("cmp", column, "==", True)
+        if (kind, op) == ("keyword", "in"):
+            self.take()
+            self.take("op", "(")
+            values = [self.parse_value()]
+            while self.peek() == ("op", ","):
+                self.take()
+                values.append(self.parse_value())
+            self.take("op", ")")
+            return ("cmp", column, "in", values)
+        self.take("op")
+        return ("cmp", column, op, self.parse_value())
+
+    def parse_value(self):
+        kind, value = self.take()
+        if kind == "keyword" and value in ("true", "false"):
+            return value == "true"
+        if kind in ("string", "number", "word"):
+            return value
+        raise QueryError(f"Expected value, got {value}")
+
+
+def string_predicate(op: str, value):
+    """Predicate on a single string for ops usable on dictionary encoded columns"""
+    if op == "==":
+        return lambda s: s == value
+    if op == "!=":
+        return lambda s: s != value
+    if op == "~":
+        return lambda s: fnmatch.fnmatchcase(s, value)
+    if op == "^=":
+        return lambda s: s.startswith(value)
+    if op == "in":
+        values = set(value)
+        return lambda s: s in values
+    raise QueryError(f"Operator {op} not supported on string columns")
+
+
+class AssetQueryEngine(object):
+    """Evaluate filters, sorting and aggregation over the asset rows of a BuildTable"""
+    def __init__(self, table):
+        self.table = table
+        self.columns = table.asset_columns()
+
+    def code_mask(self, table_name: str, op: str, value) -> np.ndarray:
+        """Evaluate predicate once per distinct string, giving a lookup mask over codes"""
+        strings = self.table.strings[table_name].tolist()
+        if table_name == "path" and op == "^=":
+            # 路径表已排序, 前缀对应一段连续的编码
+            mask = np.zeros(len(strings), dtype=bool)
+            mask[bisect.bisect_left(strings, value):bisect.bisect_left(strings, value + "\U0010ffff")] = True
+            return mask
+        predicate = string_predicate(op, value)
+        return np.fromiter((predicate(s) for s in strings), dtype=bool, count=len(strings))
+
+    def evaluate(self, node) -> np.ndarray:
+        if node is None:
+            return np.ones(self.table.asset_count, dtype=bool)
+        if node[0] == "and":
+            return self.evaluate(node[1]) & self.evaluate(node[2])
+        if node[0] == "or":
+            return self.evaluate(node[1]) | self.evaluate(node[2])
+        if node[0] == "not":
+            return ~self.evaluate(node[1])
+
+        _, column, op, value = node
+        if column in STRING_COLUMNS:
+            values = [str(v) for v in value] if op == "in" else str(value)
+            lookup = self.code_mask(STRING_COLUMNS[column], op, values)
+            return lookup[self.columns[column]]
+        if column in LIST_COLUMNS:
+            list_name, table_name = LIST_COLUMNS[column]
+            if op not in ("==", "~", "^=", "in"):
+                raise QueryError(f"Operator {op} not supported on {column}")
+            values = [str(v) for v in value] if op == "in" else str(value)
+            bundle_mask = self.table.bundle_list_mask(list_name, self.code_mask(table_name, op, values))
+            return bundle_mask[self.columns["bundle"]]
+        if column in NUMBER_COLUMNS or column in BOOL_COLUMNS:
+            data = self.columns[column]
+            if op == "in":
+                return np.isin(data, [self.number(v) for v in value])
+            value = self.number(value)
+            if op == "==":
+                return data == value
+            if op == "!=":
+                return data != value
+            if op == ">":
+                return data > value
+            if op == ">=":
+                return data >= value
+            if op == "<":
+                return data < value
+            if op == "<=":
+                return data <= value
+            raise QueryError(f"Operator {op} not supported on {column}")
+        raise QueryError(f"Unknown column: {column}")
+
+    def number(self, value):
+        if isinstance(value, (bool, int, float)):
+            return value
+        return parse_size(str(value))
+
+    def sort_key(self, column: str) -> np.ndarray:
+        """Per row sort key; string columns are ranked by their string order"""
+        if column in ("size", "bundle_size", "is_internal"):
+            return self.columns[column]
+        if column == "path":
+            return self.columns[column]
+        table_name = STRING_COLUMNS[column]
+        strings = self.table.strings[table_name].tolist()
+        rank = np.empty(len(strings), dtype=np.int64)
+        rank[np.argsort(np.array(strings, dtype=object), kind="stable")] = np.arange(len(strings))
+        return rank[self.columns[column]]
+
+    def select(self, mask: np.ndarray, sort: str = None, limit=100):
+        """Matched rows, optionally sorted ("-size", "group,path"), as dicts"""
+        rows = np.flatnonzero(mask)
+        if sort:
+            keys = []
+            for item in reversed([item.strip() for item in sort.split(",") if item.strip()]):
+                descending = item.startswith("-")
+                column = item.lstrip("+-").lower()
+                if column not in SORT_COLUMNS:
+                    raise QueryError(f"Cannot sort by {column}")
+                key = self.sort_key(column)[rows]
+                keys.append(-key.astype(np.int64) if descending else key)
+            rows = rows[np.lexsort(keys)]
+        rows = rows[:limit]
+
+        paths = self.table.strings["path"]
+        suffixes = self.table.strings["suffix"]
+        groups = self.table.strings["group"]
+        names = self.table.strings["bundle_name"]
+        columns = self.columns
+        return [{
+            "path": paths[int(columns["path"][row])],
+            "suffix": suffixes[int(columns["suffix"][row])],
+            "size": int(columns["size"][row]),
+            "bundle": names[int(columns["bundle"][row])],
+            "group": groups[int(columns["group"][row])],
+            "is_internal": bool(columns["is_internal"][row]),
+            "bundle_size": int(columns["bundle_size"][row])
+        } for row in rows]
+
+    def aggregate(self, mask: np.ndarray, group_by: str, value_column="size"):
+        """Count and sum of value_column per distinct group_by value, largest sum first"""
+        group_by = group_by.lower()
+        if group_by not in GROUP_BY_COLUMNS:
+            raise QueryError(f"Cannot group by {group_by}")
+        if value_column not in NUMBER_COLUMNS:
+            raise QueryError(f"Cannot sum {value_column}")
+        codes = self.columns[group_by][mask].astype(np.int64)
+        values = self.columns[value_column][mask]
+        if group_by == "is_internal":
+            labels = [False, True]
+        else:
+            labels = self.table.strings[STRING_COLUMNS[group_by]]
+        size = len(labels)
+        counts = np.bincount(codes, minlength=size)
+        sums = np.bincount(codes, weights=values, minlength=size)
+        result = [{"key": labels[code], "count": int(counts[code]), "sum": int(sums[code])}
+                  for code in np.flatnonzero(counts)]
+        return sorted(result, key=lambda item: item["sum"], reverse=True)
+
+
+def run_asset_query(table, filter_text: str = "", sort: str = None, limit=100, group_by: str = None, value_column="size"):
+    """Run an asset query, returns dict with match count and rows or aggregate"""
+    engine = AssetQueryEngine(table)
+    mask = engine.evaluate(FilterParser(filter_text or "").parse())
+    result = {"total_matches": int(mask.sum())}
+    if group_by:
+        result["aggregate"] = engine.aggregate(mask, group_by, value_column)
+    else:
+        result["data"] = engine.select(mask, sort, limit)
+    return result
@@ -0,0 +1,313 @@
+"""
+Optional asyncio (ASGI) serving mode.
+
+Mongo/GridFS I/O goes through the motor async driver (blobs of the `local`
+storage backend are read through the backend in the executor), CPU heavy
+parsing and aggregation runs in a bounded executor, and concurrent requests
+for the same uncached info_id share a single load.
+"""
+import asyncio
+import json
+from collections import OrderedDict
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from bson import json_util
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from pymongo import DESCENDING
+from quart import Quart, Blueprint, request, jsonify
+from quart_cors import cors
+from .bundle_info_deal import BundleInfoDeal
+from .bundle_trend_deal import BundleTrendDeal
+from .views import find_asset_generator
+from .common_task import storage, load_json_blob, parse_fields, parse_limit, select_fields
+from .project_setting import (MONGO_URI, MONGO_DB_NAME, PROJECT_CODE, BUNDLEINFO_COLLECTION, BUNDLE_ROLLUP_COLLECTION,
+                              BUILD_CACHE_SIZE, ASYNC_CPU_WORKERS, TREND_DEFAULT_LIMIT, TREND_GROWTH_THRESHOLD,
+                              STORAGE_BACKEND, STREAM_MAX_RESULTS)
+
+AsyncBuildWeb_blueprint = Blueprint('AsyncBuildWeb_blueprint', __name__)
+
+
+class SingleFlight(object):
+    """同一个key的并发调用只执行一次, 其余调用等待同一个结果"""
+    def __init__(self):
+        self.in_flight = {}
+
+    async def do(self, key, coro_factory):
+        # 加载放在独立的Task中执行, 调用方都通过shield等待:
+        # 发起请求的客户端断开(请求被取消)时, 加载继续完成, 其余等待者不受影响
+        task = self.in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(coro_factory())
+            self.in_flight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task)
+
+    def _finish(self, key, task):
+        if self.in_flight.get(key) is task:
+            del self.in_flight[key]
+        # 所有等待者都已取消时避免 "exception was never retrieved" 警告
+        if not task.cancelled():
+            task.exception()
+
+
+class AsyncBuildStore(object):
+    """Async access to bundle infos with an LRU cache of parsed builds"""
+    def __init__(self, cache_size=BUILD_CACHE_SIZE, cpu_workers=ASYNC_CPU_WORKERS):
+        self.client = None
+        self.db = None
+        self.bucket = None
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.single_flight = SingleFlight()
+        self.executor = ThreadPoolExecutor(max_workers=cpu_workers, thread_name_prefix="build_web_cpu")
+
+    def open(self):
+        self.client = AsyncIOMotorClient(MONGO_URI)
+        self.db = self.client[MONGO_DB_NAME]
+        self.bucket = AsyncIOMotorGridFSBucket(self.db)
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+        self.executor.shutdown(wait=False)
+
+    async def run_cpu(self, func, *args):
+        """Run CPU bound work in the bounded executor"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def get_bundle_detail(self, info_id: str):
+        """Get parsed bundle detail, loading it at most once for concurrent callers"""
+        if info_id in self.cache:
+            self.cache.move_to_end(info_id)
+            return self.cache[info_id]
+
+        return await self.single_flight.do(info_id, lambda: self._load_bundle_detail(info_id))
+
+    async def _load_bundle_detail(self, info_id: str):
+        doc = await self.db[BUNDLEINFO_COLLECTION].find_one({"project": info_id},
+                                                             projection={"file_id": 1, "patch": 1})
+        file_id = doc.get("file_id") if doc else None
+        data = await self._read_blob(info_id, file_id)
+        if data is None:
+            return None
+        if doc and doc.get("patch"):
+            # 补丁构建只存储了差异, 叠加到基础构建上得到完整数据
+            base_data = await self.get_bundle_detail(doc["patch"]["base_info_id"])
+            if base_data is None:
+                raise ValueError(f"Base build {doc['patch']['base_info_id']} of patch {info_id} not found")
+            data = await self.run_cpu(BundleInfoDeal().apply_patch_delta, base_data, data)
+
+        self.cache[info_id] = data
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return data
+
+    async def _read_blob(self, info_id: str, file_id):
+        """Read and parse the stored blob of a build, None if not found"""
+        if STORAGE_BACKEND != "gridfs":
+            # 其他存储后端没有异步驱动, 在executor中通过后端读取
+            return await self.run_cpu(self._read_blob_from_storage, info_id, file_id)
+
+        if file_id is None:
+            # 旧数据没有记录file_id, 按info_id查询最新上传的文件
+            cursor = self.bucket.find({"metadata.info_id": info_id}).sort("uploadDate", DESCENDING).limit(1)
+            grid_files = await cursor.to_list(length=1)
+            if not grid_files:
+                return None
+            file_id = grid_files[0]._id
+
+        stream = await self.bucket.open_download_stream(file_id)
+        data_bytes = await stream.read()
+        return await self.run_cpu(lambda: json.loads(data_bytes.decode('utf-8-sig')))
+
+    @staticmethod
+    def _read_blob_from_storage(info_id: str, file_id):
+        if file_id is None:
+            file_id = storage.find_by_info_id(info_id)
+            if file_id is None:
+                return None
+        _, data = storage.get(file_id)
+        return load_json_blob(data)
+
+    async def get_bundle_info_list(self, platform: str, schema: str, limit=1000):
+        query = {
+            "project": {
+                "$regex": f"^{PROJECT_CODE}_{platform}_{schema}_",
+                "$options": "i"
+            }
+        }
+        cursor = self.db[BUNDLEINFO_COLLECTION].find(filter=query).limit(limit)
+        return json.loads(json_util.dumps(await cursor.to_list(length=limit)))
+
+    async def get_rollups(self, platform: str, schema: str, since: str = None, limit=TREND_DEFAULT_LIMIT):
+        query = {"platform": platform, "schema": schema}
+        if since:
+            query["build_time"] = {"$gte": since}
+        cursor = self.db[BUNDLE_ROLLUP_COLLECTION].find(filter=query, projection={"_id": 0}) \
+            .sort("build_time", DESCENDING).limit(limit)
+        rollups = await cursor.to_list(length=limit)
+        rollups.reverse()
+        return rollups
+
+
+store = AsyncBuildStore()
+
+
+@AsyncBuildWeb_blueprint.route('get_bundle_info_list')
+async def read_from_bundle_infos():
+    """Get bundle info list"""
+    platform = request.args.get('platform', "Android")
+    schema = request.args.get('schema', 'Debug')
+
+    info_list = await store.get_bundle_info_list(platform, schema)
+    return jsonify({
+        'data': info_list,
+        'columns': list(info_list[0].keys()) if info_list else []
+    })
+
+
+@AsyncBuildWeb_blueprint.route('get_bundle_trends')
+async def get_bundle_trends():
+    """Get per group size trends over recent builds"""
+    platform = request.args.get('platform', "Android")
+    schema = request.args.get('schema', 'Debug')
+    since = request.args.get('since')
+    limit = request.args.get('limit', TREND_DEFAULT_LIMIT, type=int)
+    threshold = request.args.get('threshold', TREND_GROWTH_THRESHOLD, type=float)
+
+    try:
+        rollups = await store.get_rollups(platform, schema, since, limit)
+        trends = BundleTrendDeal().build_trends(rollups, threshold)
+        return jsonify({
+            "status": "success",
+            "platform": platform,
+            "schema": schema,
+            "data": trends
+        })
+
+    except Exception as e:
+        print(f"Error getting bundle trends: {str(e)}")
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+
+@AsyncBuildWeb_blueprint.route('get_bundle_group_bundles_size_and_count')
+async def get_bundle_group_bundles_size_and_count():
+    """Get bundle group statistics"""
+    info_id = request.args.get('info_id', 'l22_Android_Debug_202505191642')
+
+    try:
+        data = await store.get_bundle_detail(info_id)
+        bundle_deal = BundleInfoDeal()
+        all_stats, internal_stats, suffix_stats = await store.run_cpu(
+            lambda: bundle_deal.calculate_stats_from_grouped_data(bundle_deal.group_bundles(data)))
+        return jsonify({
+            "status": "success",
+            "all_stats": all_stats,
+            "internal_stats": internal_stats,
+            "suffix_stats": suffix_stats
+        })
+
+    except Exception as e:
+        print(f"Error getting bundle group statistics: {str(e)}")
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+
+@AsyncBuildWeb_blueprint.route('get_grouped_bundle_details')
+async def get_enhanced_group_details():
+    """获取增强版分组详情"""
+    info_id = request.args.get('info_id', 'l22_Android_Debug_202505191642')
+    group_type = request.args.get('group_type')
+
+    try:
+        data = await store.get_bundle_detail(info_id)
+        details = await store.run_cpu(BundleInfoDeal().get_enhanced_group_details, data, group_type)
+        return jsonify({
+            "status": "success",
+            "data": details
+        })
+
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": f"获取详情失败: {str(e)}"
+        }), 500
+
+
+@AsyncBuildWeb_blueprint.route('get_bundle_assets')
+async def get_bundle_assets():
+    """Get assets for specific bundle"""
+    info_id = request.args.get('info_id', 'l22_Android_Debug_202505191642')
+    bundle_name = request.args.get('bundle_name')
+
+    try:
+        data = await store.get_bundle_detail(info_id)
+        assets = await store.run_cpu(BundleInfoDeal().get_bundle_assets, data, bundle_name)
+        if assets is None:
+            return jsonify({
+                "status": "error",
+                "message": f"Bundle '{bundle_name}' not found"
+            }), 404
+
+        return jsonify({
+            "status": "success",
+            "bundle_name": bundle_name,
+            "assets": assets,
+            "total_assets": len(assets)
+        })
+
+    except Exception as e:
+        print(f"Error getting bundle assets: {str(e)}")
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+
+@AsyncBuildWeb_blueprint.route('/search_from_bundle_detail', methods=['POST'])
+async def search_from_bundle_detail():
+    """Search from bundle detail"""
+    request_data = await request.get_json(silent=True) or {}
+
+    info_id = request_data.get('info_id', '')
+    path = request_data.get('path', '')
+    fields = parse_fields(request_data.get('fields'))
+    try:
+        limit = parse_limit(request_data.get('limit'), STREAM_MAX_RESULTS, STREAM_MAX_RESULTS)
+    except ValueError as e:
+        return jsonify({'data': [], "error": str(e)}), 400
+
+    if not path or not info_id:
+        return jsonify({'data': []})
+
+    try:
+        data = await store.get_bundle_detail(info_id)
+        find_res = await store.run_cpu(
+            lambda: [select_fields(bundle, fields) for bundle in islice(find_asset_generator(data, path), limit)])
+        return jsonify({'data': find_res})
+
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        return jsonify({'data': [], "error": str(e)}), 500
+
+
+def create_async_app():
+    """Create the ASGI application serving the read routes asynchronously"""
+    app = Quart(__name__, template_folder='../templates', static_folder='../static')
+    app = cors(app, allow_origin="*")  # 允许所有路由的跨域请求
+    app.register_blueprint(AsyncBuildWeb_blueprint, url_prefix='/BuildWeb')
+
+    @app.before_serving
+    async def open_store():
+        store.open()
+
+    @app.after_serving
+    async def close_store():
+        store.close()
+
+    return app
@@ -0,0 +1,202 @@
+"""
+Parallel multi-build batch analysis (backfills, trend rebuilds, audits).
+
+Builds are fanned out across a process pool; each worker loads and parses its
+build from storage and returns only a compact result, which is stored with the
+job's progress. Progress is checkpointed in a job document, so re-running a job
+skips the builds it already finished.
+A job is claimed atomically in its document, so it runs at most once at a time
+across all processes and hosts.
+
+Usage:
+    python -m build_web.batch_analysis --platform Android --schema Debug --since 20250101 --job-id backfill
+"""
+import argparse
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from .common_task import BaseInfoDeal, db
+from .bundle_info_deal import BundleInfoDeal, bundle_info_list_query
+from .bundle_trend_deal import BundleTrendDeal, split_info_id
+from .project_setting import (BUNDLEINFO_COLLECTION, BATCH_JOB_COLLECTION, BATCH_ANALYSIS_WORKERS,
+                              BATCH_JOB_STALE_SECONDS)
+
+
+def validate_workers(workers):
+    """Worker count must be None (default) or a positive int"""
+    if workers is not None and (isinstance(workers, bool) or not isinstance(workers, int) or workers < 1):
+        raise ValueError(f"workers must be a positive integer, got {workers!r}")
+    return workers
+
+
+def analyse_build(info_id: str) -> dict:
+    """在worker进程中加载并分析一个构建, 只返回紧凑的结果"""
+    start = time.time()
+    data = BundleInfoDeal().load_bundle_detail_info(info_id)
+    if data is None:
+        raise ValueError(f"Bundle info of {info_id} not found")
+
+    _, platform, schema, build_time = split_info_id(info_id)
+    # 汇总信息都来自同一次分组统计, 不再重复解析
+    rollup = BundleTrendDeal().build_rollup(info_id, platform, schema, build_time, data)
+    bundles = data.get("Bundles", [])
+    return {
+        "info_id": info_id,
+        "rollup": rollup,
+        "summary": {
+            "info_id": info_id,
+            "total_size": rollup["total_size"],
+            "internal_size": sum(group["internal_size"] for group in rollup["groups"]),
+            "bundle_count": len(bundles),
+            "asset_count": sum(len(bundle.get("Assets", [])) for bundle in bundles),
+            "unique_asset_count": sum(group["asset_count"] for group in rollup["groups"]),
+            "elapsed": round(time.time() - start, 3)
+        }
+    }
+
+
+class BatchAnalysisDeal(BaseInfoDeal):
+    def __init__(self):
+        super().__init__(BATCH_JOB_COLLECTION)
+
+    def select_builds(self, platform: str = None, schema: str = None, since: str = None) -> list:
+        """Info IDs of the builds to analyse, oldest first"""
+        query = bundle_info_list_query(platform or ".*", schema or ".*")
+        if since:
+            query["build_time"] = {"$gte": since}
+        cursor = db[BUNDLEINFO_COLLECTION].find(filter=query, projection={"project": 1}).sort("build_time", ASCENDING)
+        return [doc["project"] for doc in cursor]
+
+    def get_job(self, job_id: str):
+        return db[self.collection_name].find_one({"job_id": job_id}, projection={"_id": 0})
+
+    def claim_job(self, job_id: str, info_ids: list):
+        """Atomically create or resume the job and mark it running, None if it is already running
+
+        Existing jobs keep their info_ids and finished builds, so a resume skips them.
+        """
+        collection = db[self.collection_name]
+        collection.create_index("job_id", unique=True)
+        now = time.time()
+        try:
+            # 任务正在运行时过滤条件不匹配, upsert插入会触发job_id唯一索引冲突;
+            # 两个请求同时创建同一个任务时, 后到的一方同样得到冲突
+            job = collection.find_one_and_update(
+                {"job_id": job_id,
+                 "$or": [{"state": {"$ne": "running"}}, {"updated_at": {"$lt": now - BATCH_JOB_STALE_SECONDS}}]},
+                {"$set": {"state": "running", "updated_at": now},
+                 "$setOnInsert": {"info_ids": info_ids, "done": [], "failed": [], "results": [], "created_at": now}},
+                upsert=True, return_document=ReturnDocument.AFTER)
+        except DuplicateKeyError:
+            return None
+        job.pop("_id", None)
+        return job
+
+    def mark_done(self, job_id: str, info_id: str, summary: dict):
+        collection = db[self.collection_name]
+        # 重新分析时替换该构建之前的结果
+        collection.update_one({"job_id": job_id}, {"$pull": {"failed": {"info_id": info_id},
+                                                             "results": {"info_id": info_id}}})
+        collection.update_one(
+            {"job_id": job_id},
+            {"$addToSet": {"done": info_id}, "$push": {"results": summary},
+             "$set": {"updated_at": time.time()}})
+
+    def mark_failed(self, job_id: str, info_id: str, message: str):
+        collection = db[self.collection_name]
+        collection.update_one({"job_id": job_id}, {"$pull": {"failed": {"info_id": info_id}}})
+        collection.update_one({"job_id": job_id},
+                              {"$push": {"failed": {"info_id": info_id, "error": message}},
+                               "$set": {"updated_at": time.time()}})
+
+    def set_state(self, job_id: str, state: str):
+        db[self.collection_name].update_one({"job_id": job_id}, {"$set": {"state": state, "updated_at": time.time()}})
+
+    def run_job(self, job_id: str, info_ids: list = None, workers: int = None, progress=None) -> dict:
+        """Run (or resume) a batch analysis job across a process pool sized to the cores"""
+        validate_workers(workers)
+        job = self.claim_job(job_id, info_ids or [])
+        if job is None:
+            raise RuntimeError(f"Batch analysis '{job_id}' is already running")
+        return self.execute_job(job, workers, progress)
+
+    def execute_job(self, job: dict, workers: int = None, progress=None) -> dict:
+        """Analyse the pending builds of a claimed job"""
+        job_id = job["job_id"]
+        done = set(job["done"])
+        pending = [info_id for info_id in job["info_ids"] if info_id not in done]
+        total = len(job["info_ids"])
+        workers = max(1, min(workers or BATCH_ANALYSIS_WORKERS, len(pending)))
+        print(f"Batch analysis {job_id}: {len(pending)} of {total} builds pending, {workers} workers")
+
+        trend_deal = BundleTrendDeal()
+        finished = total - len(pending)
+        # MongoClient不能跨fork使用, worker进程用spawn启动并各自连接
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = {executor.submit(analyse_build, info_id): info_id for info_id in pending}
+            for future in as_completed(futures):
+                info_id = futures[future]
+                try:
+                    result = future.result()
+                    trend_deal.save_rollup_to_collection(result["rollup"])
+                    self.mark_done(job_id, info_id, result["summary"])
+                except Exception as e:
+                    print(f"Batch analysis of {info_id} failed: {e}")
+                    self.mark_failed(job_id, info_id, str(e))
+                finished += 1
+                if progress:
+                    progress(finished, total, info_id)
+
+        job = self.get_job(job_id)
+        self.set_state(job_id, "failed" if job["failed"] else "done")
+        return self.get_job(job_id)
+
+
+def start_batch_analysis_job(job_id: str, info_ids: list, workers: int = None) -> bool:
+    """Claim job and run it in a background thread of the web process, returns False if it is already running"""
+    validate_workers(workers)
+    batch_deal = BatchAnalysisDeal()
+    job = batch_deal.claim_job(job_id, info_ids or [])
+    if job is None:
+        return False
+    threading.Thread(target=run_batch_analysis_job, args=(batch_deal, job, workers),
+                     name=f"batch_analysis_{job_id}", daemon=True).start()
+    return True
+
+
+def run_batch_analysis_job(batch_deal: BatchAnalysisDeal, job: dict, workers: int = None):
+    try:
+        batch_deal.execute_job(job, workers)
+    except Exception as e:
+        print(f"Batch analysis {job['job_id']} aborted: {e}")
+        batch_deal.set_state(job["job_id"], "aborted")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch analyse historical builds and rebuild their trend rollups")
+    parser.add_argument("--job-id", required=True, help="re-run with the same job id to resume")
+    parser.add_argument("--platform")
+    parser.add_argument("--schema")
+    parser.add_argument("--since", help="only builds with build_time >= since")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    batch_deal = BatchAnalysisDeal()
+    info_ids = batch_deal.select_builds(args.platform, args.schema, args.since)
+    start = time.time()
+
+    def progress(finished, total, info_id):
+        print(f"[{finished}/{total}] {info_id} ({time.time() - start:.1f}s)")
+
+    try:
+        job = batch_deal.run_job(args.job_id, info_ids, args.workers, progress)
+    except (ValueError, RuntimeError) as e:
+        raise SystemExit(str(e))
+    print(f"Batch analysis {args.job_id} {job['state']}: {len(job['done'])} done, {len(job['failed'])} failed")
+
+
+if __name__ == "__main__":
+    main()
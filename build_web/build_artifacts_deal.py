@@ -0,0 +1,251 @@
+"""
+Ingest all artifacts of one CI build (BundleInfos, ShaderReport, DLC info and
+DLC design map) in a single upload.
+
+Artifacts are read and parsed in parallel, then written as one unit: the bundle
+blob first, then the collection docs with one bulk_write per collection. The
+`local` database cannot run multi-document transactions, so a failure is rolled
+back by deleting everything this upload wrote.
+"""
+import fnmatch
+import json
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from bson import ObjectId
+from pymongo import InsertOne
+from pymongo.errors import BulkWriteError, PyMongoError
+from werkzeug.utils import secure_filename
+from .common_task import db, storage, hash_bytes, find_gridfs_file_by_hash
+from .bundle_info_deal import BundleInfoDeal
+from .bundle_trend_deal import BundleTrendDeal, build_upload_rollup
+from .project_setting import (BUNDLEINFO_COLLECTION, SHADERVARIANT_COLLECTION, DLC_COLLECTION,
+                              DLC_DESIGN_MAP_COLLECTION, BUNDLE_ROLLUP_COLLECTION, METADATA_VERSION,
+                              ARCHIVE_ARTIFACT_PATTERNS, UPLOAD_ARCHIVE_MAX_BYTES, UPLOAD_PARSE_WORKERS)
+
+# 产物类型 -> (集合, 文档中存放内容的字段)
+ARTIFACT_COLLECTIONS = {
+    "bundle_info": (BUNDLEINFO_COLLECTION, None),
+    "shader_report": (SHADERVARIANT_COLLECTION, "variants"),
+    "dlc_info": (DLC_COLLECTION, "dlcs"),
+    "dlc_design_map": (DLC_DESIGN_MAP_COLLECTION, "dlcs"),
+}
+
+
+class ArtifactUploadError(Exception):
+    """Upload rejected before anything was written; carries the HTTP status"""
+    def __init__(self, message: str, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def collect_request_artifacts(request_obj) -> dict:
+    """Raw bytes of each artifact, from multipart fields or a zip archive"""
+    artifacts = {}
+    archive = request_obj.files.get('archive')
+    if archive is not None and archive.filename:
+        artifacts.update(read_archive_artifacts(archive))
+
+    for name in ARTIFACT_COLLECTIONS:
+        file = request_obj.files.get(name)
+        if file is None or not file.filename:
+            continue
+        if not secure_filename(file.filename).endswith('.json'):
+            raise ArtifactUploadError(f"{name}: 仅支持JSON文件")
+        artifacts[name] = file.read()
+
+    if not artifacts:
+        raise ArtifactUploadError(f"缺少文件参数, expected archive or any of {', '.join(ARTIFACT_COLLECTIONS)}")
+    return artifacts
+
+
+def read_archive_artifacts(archive) -> dict:
+    """Match archive members to artifacts by file name pattern"""
+    try:
+        with zipfile.ZipFile(archive.stream) as zf:
+            members = [info for info in zf.infolist() if not info.is_dir()]
+            if sum(info.file_size for info in members) > UPLOAD_ARCHIVE_MAX_BYTES:
+                raise ArtifactUploadError("Archive too large", 413)
+
+            matched = {}
+            for info in members:
+                basename = os.path.basename(info.filename)
+                name = match_artifact_name(basename)
+                if name is None:
+                    # 未匹配的JSON文件多半是命名不符的产物, 拒绝而不是静默忽略
+                    if basename.lower().endswith(".json"):
+                        raise ArtifactUploadError(f"Archive file {info.filename} matches no artifact pattern")
+                    continue
+                if name in matched:
+                    raise ArtifactUploadError(f"Archive contains more than one {name}: {basename}")
+                matched[name] = info
+            # zlib解压会释放GIL, 各成员并行解压
+            with ThreadPoolExecutor(max_workers=UPLOAD_PARSE_WORKERS) as executor:
+                return dict(zip(matched, executor.map(zf.read, matched.values())))
+    except zipfile.BadZipFile:
+        raise ArtifactUploadError("Invalid zip archive")
+
+
+def match_artifact_name(basename: str):
+    """Artifact name of an archive member, matched case-insensitively; None if no pattern matches"""
+    for name, pattern in ARCHIVE_ARTIFACT_PATTERNS:
+        if fnmatch.fnmatchcase(basename.lower(), pattern.lower()):
+            return name
+    return None
+
+
+def parse_artifact(name: str, data: bytes):
+    """(name, content hash, parsed JSON) of one artifact"""
+    try:
+        return name, hash_bytes(data), json.loads(data.decode('utf-8-sig'))
+    except ValueError as e:
+        raise ArtifactUploadError(f"{name}: invalid JSON ({e})")
+
+
+class BuildArtifactsDeal(object):
+    def __init__(self, info_id: str, platform: str, schema: str, build_time: str):
+        self.info_id = info_id
+        self.platform = platform
+        self.schema = schema
+        self.build_time = build_time
+        self.bundle_deal = BundleInfoDeal()
+        self.inserted = {}
+        self.new_file_id = None
+        self.rollup_saved = False
+
+    def parse_all(self, artifacts: dict) -> dict:
+        """Parse artifacts in parallel, returns name -> (content hash, data)"""
+        with ThreadPoolExecutor(max_workers=UPLOAD_PARSE_WORKERS) as executor:
+            results = list(executor.map(parse_artifact, artifacts.keys(), artifacts.values()))
+        return {name: (content_hash, data) for name, content_hash, data in results}
+
+    def check_existing(self, parsed: dict) -> list:
+        """Artifacts already ingested with the same content are skipped; different content is a conflict"""
+        skipped = []
+        for name, (content_hash, data) in parsed.items():
+            collection_name, field = ARTIFACT_COLLECTIONS[name]
+            existing = db[collection_name].find_one({"project": self.info_id})
+            if existing is None:
+                continue
+            if not self.same_content(name, existing, content_hash, data):
+                raise ArtifactUploadError(
+                    f'[DUPLICATE] Project "{self.info_id}" already has a different {name} in {collection_name}', 409)
+            skipped.append(name)
+        return skipped
+
+    def same_content(self, name: str, existing: dict, content_hash: str, data) -> bool:
+        """比较已有文档; 旧版单文件接口写入的文档没有content_hash时比较解析后的内容"""
+        if existing.get("content_hash"):
+            return existing["content_hash"] == content_hash
+        _, field = ARTIFACT_COLLECTIONS[name]
+        if field:
+            return existing.get(field) == data
+        return self.bundle_deal.load_bundle_detail_info(self.info_id) == data
+
+    def build_doc(self, name: str, content_hash: str, data, file_id=None, patch=None) -> dict:
+        doc = {
+            "project": self.info_id,
+            "build_time": self.build_time,
+            "content_hash": content_hash,
+            "metadata": {"version": METADATA_VERSION}
+        }
+        _, field = ARTIFACT_COLLECTIONS[name]
+        if field:
+            doc[field] = data
+        else:
+            doc["file_id"] = file_id
+            if patch:
+                doc["patch"] = patch
+        return doc
+
+    def save_bundle_blob(self, raw: bytes, content_hash: str, data: dict, base_info_id=None, base_loader=None):
+        """Store the bundle blob (the delta for patch builds), returns (file_id, patch summary)"""
+        patch = None
+        info_type = "json"
+        if base_info_id:
+            base_data = base_loader(base_info_id)
+            if base_data is None:
+                raise ArtifactUploadError(f'Base build "{base_info_id}" not found', 404)
+            delta = self.bundle_deal.build_patch_delta(base_data, data)
+            patch = self.bundle_deal.patch_summary(base_info_id, delta)
+            raw = json.dumps(delta, ensure_ascii=False).encode('utf-8')
+            content_hash = hash_bytes(raw)
+            info_type = "patch_delta"
+
+        file_id = find_gridfs_file_by_hash(content_hash)
+        if file_id is None:
+            file_id = self.bundle_deal.save_bundle_info_to_gridfs(self.info_id, info_type, raw, content_hash)
+            self.new_file_id = file_id
+        return file_id, patch
+
+    def ingest(self, artifacts: dict, base_info_id=None, base_loader=None) -> dict:
+        """Parse and write all artifacts of the build, all or nothing"""
+        parsed = self.parse_all(artifacts)
+        skipped = self.check_existing(parsed)
+        pending = [name for name in parsed if name not in skipped]
+        rollup = None
+        if "bundle_info" in pending:
+            # 写入前生成汇总, 格式错误的构建在写入任何内容之前被拒绝
+            try:
+                rollup = build_upload_rollup(self.info_id, self.platform, self.schema, self.build_time,
+                                             parsed["bundle_info"][1])
+            except ValueError as e:
+                raise ArtifactUploadError(f"bundle_info: {e}")
+
+        try:
+            docs = {}
+            patch = None
+            for name in pending:
+                content_hash, data = parsed[name]
+                file_id = None
+                if name == "bundle_info":
+                    file_id, patch = self.save_bundle_blob(artifacts[name], content_hash, data,
+                                                           base_info_id, base_loader)
+                docs.setdefault(ARTIFACT_COLLECTIONS[name][0], []).append(
+                    self.build_doc(name, content_hash, data, file_id, patch))
+
+            # bundle info文档最后写入: 它出现后构建才在列表中可见
+            for collection_name in sorted(docs, key=lambda key: key == BUNDLEINFO_COLLECTION):
+                self.bulk_insert(collection_name, docs[collection_name])
+
+            if rollup is not None:
+                BundleTrendDeal().save_rollup_to_collection(rollup)
+                self.rollup_saved = True
+        except BulkWriteError as e:
+            self.rollback()
+            raise ArtifactUploadError(f'[DUPLICATE] Project "{self.info_id}" was ingested concurrently: '
+                                      f'{e.details.get("writeErrors", [{}])[0].get("errmsg")}', 409)
+        except Exception:
+            self.rollback()
+            raise
+
+        return {"ingested": pending, "skipped": skipped, "patch": patch}
+
+    def bulk_insert(self, collection_name: str, docs: list):
+        collection = db[collection_name]
+        collection.create_index("project", unique=True)
+        # 预先分配_id, 部分写入失败时也能准确回滚
+        for doc in docs:
+            doc["_id"] = ObjectId()
+        self.inserted[collection_name] = [doc["_id"] for doc in docs]
+        result = collection.bulk_write([InsertOne(doc) for doc in docs], ordered=True)
+        print(f"Bulk insert into {collection_name}: {result.inserted_count} docs")
+
+    def rollback(self):
+        """删除本次上传已写入的文档和新文件"""
+        print(f"Rolling back upload of {self.info_id}")
+        for collection_name, ids in self.inserted.items():
+            try:
+                db[collection_name].delete_many({"_id": {"$in": ids}})
+            except PyMongoError as e:
+                print(f"Rollback of {collection_name} failed: {e}")
+        if self.rollup_saved:
+            db[BUNDLE_ROLLUP_COLLECTION].delete_one({"project": self.info_id})
+        if self.new_file_id is not None:
+            try:
+                storage.delete(self.new_file_id)
+            except Exception as e:
+                print(f"Rollback of file {self.new_file_id} failed: {e}")
+        self.inserted = {}
+        self.new_file_id = None
+        self.rollup_saved = False
@@ -0,0 +1,438 @@
+"""
+Flat, array backed (columnar) form of a parsed build.
+
+Every column is a NumPy array, so a table can be saved once as .npy files and
+memory-mapped read-only by any number of processes. Fields the columns cannot
+restore exactly (unknown fields, missing fields, values of an unexpected type)
+are kept per bundle and per asset as a JSON side record, so the rebuilt
+BundleInfos equal the uploaded ones.
+"""
+import bisect
+import json
+import os
+import numpy as np
+
+BUNDLE_INT_FIELDS = ("XXHash", "Size", "CombineSize", "CombineOffset", "CombineHash", "DownloadVersion")
+BUNDLE_BOOL_FIELDS = ("IsInternal", "IsBundle")
+ASSET_INT_FIELDS = ("Size", "InnerSize", "XXHash")
+
+# 保存格式变化时递增, 共享缓存目录按版本区分, 不会读到旧格式的表
+TABLE_FORMAT_VERSION = 2
+
+
+def _is_int64(value):
+    return type(value) is int and -2 ** 63 <= value < 2 ** 63
+
+
+def _is_str(value):
+    return type(value) is str
+
+
+def _is_bool(value):
+    return type(value) is bool
+
+
+def _is_str_list(value):
+    return type(value) is list and all(type(item) is str for item in value)
+
+
+def _is_dict_list(value):
+    return type(value) is list and all(type(item) is dict for item in value)
+
+
+def _to_int64(value, default):
+    try:
+        value = int(value)
+    except (TypeError, ValueError, OverflowError):
+        return default
+    return value if _is_int64(value) else default
+
+
+def _to_bool(value, default):
+    return bool(value)
+
+
+def _to_default(value, default):
+    return default
+
+
+# 列中保存的字段: 字段 -> (能否由列精确还原, 无法还原时列中使用的近似值, 缺失时的默认值)
+BUNDLE_FIELDS = dict(
+    [(field, (_is_str, _to_default, "")) for field in ("FileName", "GroupType", "CombineName")]
+    + [(field, (_is_int64, _to_int64, 0)) for field in BUNDLE_INT_FIELDS]
+    + [(field, (_is_bool, _to_bool, False)) for field in BUNDLE_BOOL_FIELDS]
+    + [("Labels", (_is_str_list, _to_default, [])), ("DlcGroups", (_is_str_list, _to_default, [])),
+       ("Assets", (_is_dict_list, _to_default, []))])
+ASSET_FIELDS = dict([("AssetPath", (_is_str, _to_default, ""))]
+                    + [(field, (_is_int64, _to_int64, 0)) for field in ASSET_INT_FIELDS])
+
+
+def asset_suffix(asset_path: str) -> str:
+    """与统计接口一致的资源后缀"""
+    return os.path.splitext(asset_path)[1].lower() or "NoExtension"
+
+
+class StringTable(object):
+    """Strings stored as one utf-8 blob plus offsets"""
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray):
+        self.blob = blob
+        self.offsets = offsets
+        self._strings = None
+
+    @classmethod
+    def from_strings(cls, strings):
+        encoded = [s.encode("utf-8") for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return cls(blob, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if self._strings is not None:
+            return self._strings[i]
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("utf-8")
+
+    def tolist(self):
+        """Decode all strings once, kept for later lookups"""
+        if self._strings is None:
+            data = self.blob.tobytes()
+            offsets = self.offsets.tolist()
+            self._strings = [data[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)]
+        return self._strings
+
+
+def split_row(row: dict, fields: dict):
+    """(column values, side record) of one bundle/asset; the side record is "" when the columns restore it exactly"""
+    if row.keys() == fields.keys() and all(check(row[field]) for field, (check, _, _) in fields.items()):
+        return row, ""
+    values = {}
+    extra = {}
+    missing = []
+    for field, (check, convert, default) in fields.items():
+        if field not in row:
+            missing.append(field)
+            values[field] = default
+        elif check(row[field]):
+            values[field] = row[field]
+        else:
+            # 原值保存在side记录中, 列中只放统计用的近似值
+            extra[field] = row[field]
+            values[field] = convert(row[field], default)
+    for key, value in row.items():
+        if key not in fields:
+            extra[key] = value
+    side = {}
+    if extra:
+        side["extra"] = extra
+    if missing:
+        side["missing"] = missing
+    return values, json.dumps(side, ensure_ascii=False) if side else ""
+
+
+def restore_row(row: dict, side: str) -> dict:
+    """Apply the side record written by split_row to a row rebuilt from the columns"""
+    if side:
+        side = json.loads(side)
+        for field in side.get("missing", []):
+            del row[field]
+        row.update(side.get("extra", {}))
+    return row
+
+
+def encode_dictionary(values, sort=False):
+    """Dictionary encode strings, returns (codes, StringTable); codes follow first appearance unless sort"""
+    if sort:
+        uniques = sorted(set(values))
+    else:
+        uniques = list(dict.fromkeys(values))
+    index = {value: code for code, value in enumerate(uniques)}
+    codes = np.fromiter((index[value] for value in values), dtype=np.int32, count=len(values))
+    return codes, StringTable.from_strings(uniques)
+
+
+def encode_lists(lists):
+    """Encode list of string lists as (offsets, codes, StringTable)"""
+    offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+    np.cumsum([len(items) for items in lists], out=offsets[1:])
+    codes, table = encode_dictionary([item for items in lists for item in items])
+    return offsets, codes, table
+
+
+class BuildTable(object):
+    """Columnar bundle info of one build
+
+    Bundle level columns are indexed by bundle index, asset level columns by
+    asset index; `asset_offsets[i]:asset_offsets[i + 1]` are the assets of
+    bundle i. Asset paths are dictionary encoded against a sorted path table,
+    so a path prefix maps to one contiguous code range.
+    """
+    def __init__(self, columns: dict, strings: dict, extra: dict):
+        self.columns = columns
+        self.strings = strings
+        self.extra = extra
+        self._bundle_index = None
+        self._asset_columns = None
+
+    @classmethod
+    def from_bundle_info(cls, data: dict):
+        columns = {}
+        strings = {}
+        bundle_rows = [split_row(bundle, BUNDLE_FIELDS) for bundle in data.get("Bundles", [])]
+        bundles = [values for values, _ in bundle_rows]
+        strings["bundle_side"] = StringTable.from_strings([side for _, side in bundle_rows])
+
+        strings["bundle_name"] = StringTable.from_strings([bundle["FileName"] for bundle in bundles])
+        columns["bundle_group"], strings["group"] = encode_dictionary([bundle["GroupType"] for bundle in bundles])
+        columns["bundle_combine"], strings["combine_name"] = \
+            encode_dictionary([bundle["CombineName"] for bundle in bundles])
+        for field in BUNDLE_INT_FIELDS:
+            columns[f"bundle_{field}"] = np.array([bundle[field] for bundle in bundles], dtype=np.int64)
+        for field in BUNDLE_BOOL_FIELDS:
+            columns[f"bundle_{field}"] = np.array([bundle[field] for bundle in bundles], dtype=bool)
+
+        columns["label_offsets"], columns["label_codes"], strings["label"] = \
+            encode_lists([bundle["Labels"] for bundle in bundles])
+        columns["dlc_offsets"], columns["dlc_codes"], strings["dlc_group"] = \
+            encode_lists([bundle["DlcGroups"] for bundle in bundles])
+
+        asset_rows = [split_row(asset, ASSET_FIELDS) for bundle in bundles for asset in bundle["Assets"]]
+        assets = [values for values, _ in asset_rows]
+        strings["asset_side"] = StringTable.from_strings([side for _, side in asset_rows])
+        columns["asset_offsets"] = np.zeros(len(bundles) + 1, dtype=np.int64)
+        np.cumsum([len(bundle["Assets"]) for bundle in bundles], out=columns["asset_offsets"][1:])
+        columns["asset_bundle"] = np.repeat(np.arange(len(bundles), dtype=np.int32),
+                                            np.diff(columns["asset_offsets"]))
+        asset_paths = [asset["AssetPath"] for asset in assets]
+        columns["asset_path"], strings["path"] = encode_dictionary(asset_paths, sort=True)
+        columns["asset_suffix"], strings["suffix"] = encode_dictionary([asset_suffix(path) for path in asset_paths])
+        for field in ASSET_INT_FIELDS:
+            columns[f"asset_{field}"] = np.array([asset[field] for asset in assets], dtype=np.int64)
+
+        extra = {key: value for key, value in data.items() if key != "Bundles"}
+        return cls(columns, strings, extra)
+
+    def save(self, path: str):
+        """Save table as .npy files (plus extra.json) into directory path"""
+        os.makedirs(path, exist_ok=True)
+        for name, column in self.columns.items():
+            np.save(os.path.join(path, f"{name}.npy"), column)
+        for name, table in self.strings.items():
+            np.save(os.path.join(path, f"str_{name}.blob.npy"), table.blob)
+            np.save(os.path.join(path, f"str_{name}.offsets.npy"), table.offsets)
+        with open(os.path.join(path, "extra.json"), "w", encoding="utf-8") as f:
+            json.dump(self.extra, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str, mmap_mode="r"):
+        """Load table saved by save(), memory-mapped read-only by default"""
+        columns = {}
+        strings = {}
+        for file_name in os.listdir(path):
+            if not file_name.endswith(".npy"):
+                continue
+            file_path = os.path.join(path, file_name)
+            if file_name.startswith("str_"):
+                name, part, _ = file_name[len("str_"):].rsplit(".", 2)
+                strings.setdefault(name, {})[part] = np.load(file_path, mmap_mode=mmap_mode)
+            else:
+                columns[file_name[:-len(".npy")]] = np.load(file_path, mmap_mode=mmap_mode)
+        with open(os.path.join(path, "extra.json"), "r", encoding="utf-8") as f:
+            extra = json.load(f)
+        strings = {name: StringTable(parts["blob"], parts["offsets"]) for name, parts in strings.items()}
+        return cls(columns, strings, extra)
+
+    @property
+    def bundle_count(self):
+        return len(self.columns["asset_offsets"]) - 1
+
+    @property
+    def asset_count(self):
+        return len(self.columns["asset_path"])
+
+    def bundle_index(self, bundle_name: str):
+        """Find bundle index by file name, None if not found"""
+        if self._bundle_index is None:
+            self._bundle_index = {name: i for i, name in enumerate(self.strings["bundle_name"].tolist())}
+        return self._bundle_index.get(bundle_name)
+
+    def asset_columns(self) -> dict:
+        """Asset level columns joined with the columns of their bundle"""
+        if self._asset_columns is None:
+            columns = self.columns
+            asset_bundle = columns["asset_bundle"]
+            self._asset_columns = {
+                "path": columns["asset_path"],
+                "suffix": columns["asset_suffix"],
+                "size": columns["asset_Size"],
+                "bundle": asset_bundle,
+                "group": columns["bundle_group"][asset_bundle],
+                "is_internal": columns["bundle_IsInternal"][asset_bundle],
+                "bundle_size": columns["bundle_Size"][asset_bundle]
+            }
+        return self._asset_columns
+
+    def bundle_list_mask(self, list_name: str, code_mask: np.ndarray) -> np.ndarray:
+        """Bundle mask of bundles having any Labels/DlcGroups entry whose code is selected by code_mask"""
+        offsets = self.columns[f"{list_name}_offsets"]
+        codes = self.columns[f"{list_name}_codes"]
+        entry_bundle = np.repeat(np.arange(self.bundle_count), np.diff(offsets))
+        mask = np.zeros(self.bundle_count, dtype=bool)
+        mask[entry_bundle[code_mask[codes]]] = True
+        return mask
+
+    def bundle_dict(self, i: int) -> dict:
+        """Rebuild bundle i in the original BundleInfos format"""
+        columns = self.columns
+        strings = self.strings
+        bundle = {
+            "FileName": strings["bundle_name"][i],
+            "IsInternal": bool(columns["bundle_IsInternal"][i]),
+            "IsBundle": bool(columns["bundle_IsBundle"][i]),
+            "GroupType": strings["group"][int(columns["bundle_group"][i])],
+            "XXHash": int(columns["bundle_XXHash"][i]),
+            "Size": int(columns["bundle_Size"][i]),
+            "CombineName": strings["combine_name"][int(columns["bundle_combine"][i])],
+            "CombineSize": int(columns["bundle_CombineSize"][i]),
+            "CombineOffset": int(columns["bundle_CombineOffset"][i]),
+            "CombineHash": int(columns["bundle_CombineHash"][i]),
+            "DownloadVersion": int(columns["bundle_DownloadVersion"][i]),
+            "Labels": [strings["label"][int(code)] for code in
+                       columns["label_codes"][columns["label_offsets"][i]:columns["label_offsets"][i + 1]]],
+            "DlcGroups": [strings["dlc_group"][int(code)] for code in
+                          columns["dlc_codes"][columns["dlc_offsets"][i]:columns["dlc_offsets"][i + 1]]],
+            "Assets": []
+        }
+        start, end = columns["asset_offsets"][i], columns["asset_offsets"][i + 1]
+        for a in range(start, end):
+            bundle["Assets"].append(restore_row({
+                "AssetPath": strings["path"][int(columns["asset_path"][a])],
+                "Size": int(columns["asset_Size"][a]),
+                "InnerSize": int(columns["asset_InnerSize"][a]),
+                "XXHash": int(columns["asset_XXHash"][a])
+            }, strings["asset_side"][a]))
+        return restore_row(bundle, strings["bundle_side"][i])
+
+    def group_bundle_indices(self, group_type: str) -> np.ndarray:
+        """Indices of the bundles in group_type, in original order"""
+        groups = self.strings["group"].tolist()
+        if group_type not in groups:
+            return np.zeros(0, dtype=np.int64)
+        return np.flatnonzero(self.columns["bundle_group"] == groups.index(group_type))
+
+    def path_bundle_indices(self, path: str) -> np.ndarray:
+        """Indices of the bundles whose file name or any asset path equals path, in original order"""
+        code = self.path_code(path)
+        if code is None:
+            bundles = np.zeros(0, dtype=np.int64)
+        else:
+            bundles = self.columns["asset_bundle"][np.flatnonzero(self.columns["asset_path"] == code)]
+        bundle_index = self.bundle_index(path)
+        if bundle_index is not None:
+            bundles = np.append(bundles, bundle_index)
+        return np.unique(bundles)
+
+    def path_code(self, path: str):
+        """Code of path in the sorted path table, None if no asset has that path"""
+        paths = self.strings["path"].tolist()
+        code = bisect.bisect_left(paths, path)
+        return code if code < len(paths) and paths[code] == path else None
+
+    def subset_bundle_info(self, indices) -> dict:
+        """Rebuild only the given bundles in the original BundleInfos format"""
+        data = dict(self.extra)
+        data["Bundles"] = [self.bundle_dict(int(i)) for i in indices]
+        return data
+
+    def to_bundle_info(self) -> dict:
+        """Rebuild the whole build in the original BundleInfos format"""
+        columns = self.columns
+        names = self.strings["bundle_name"].tolist()
+        groups = self.strings["group"].tolist()
+        combine_names = self.strings["combine_name"].tolist()
+        labels = self.strings["label"].tolist()
+        dlc_groups = self.strings["dlc_group"].tolist()
+        paths = self.strings["path"].tolist()
+        bundle_sides = self.strings["bundle_side"].tolist()
+        asset_sides = self.strings["asset_side"].tolist()
+
+        bundle_columns = {field: columns[f"bundle_{field}"].tolist() for field in BUNDLE_INT_FIELDS + BUNDLE_BOOL_FIELDS}
+        bundle_group = columns["bundle_group"].tolist()
+        bundle_combine = columns["bundle_combine"].tolist()
+        label_offsets, label_codes = columns["label_offsets"].tolist(), columns["label_codes"].tolist()
+        dlc_offsets, dlc_codes = columns["dlc_offsets"].tolist(), columns["dlc_codes"].tolist()
+        asset_offsets = columns["asset_offsets"].tolist()
+        asset_path = columns["asset_path"].tolist()
+        asset_columns = {field: columns[f"asset_{field}"].tolist() for field in ASSET_INT_FIELDS}
+
+        bundles = []
+        for i in range(self.bundle_count):
+            bundles.append(restore_row({
+                "FileName": names[i],
+                "IsInternal": bundle_columns["IsInternal"][i],
+                "IsBundle": bundle_columns["IsBundle"][i],
+                "GroupType": groups[bundle_group[i]],
+                "XXHash": bundle_columns["XXHash"][i],
+                "Size": bundle_columns["Size"][i],
+                "CombineName": combine_names[bundle_combine[i]],
+                "CombineSize": bundle_columns["CombineSize"][i],
+                "CombineOffset": bundle_columns["CombineOffset"][i],
+                "CombineHash": bundle_columns["CombineHash"][i],
+                "DownloadVersion": bundle_columns["DownloadVersion"][i],
+                "Labels": [labels[code] for code in label_codes[label_offsets[i]:label_offsets[i + 1]]],
+                "DlcGroups": [dlc_groups[code] for code in dlc_codes[dlc_offsets[i]:dlc_offsets[i + 1]]],
+                "Assets": [restore_row({
+                    "AssetPath": paths[asset_path[a]],
+                    "Size": asset_columns["Size"][a],
+                    "InnerSize": asset_columns["InnerSize"][a],
+                    "XXHash": asset_columns["XXHash"][a]
+                }, asset_sides[a]) for a in range(asset_offsets[i], asset_offsets[i + 1])]
+            }, bundle_sides[i]))
+
+        data = dict(self.extra)
+        data["Bundles"] = bundles
+        return data
+
+    def group_stats(self):
+        """向量化计算分组统计, 结果与 BundleInfoDeal.calculate_stats_from_grouped_data 一致"""
+        columns = self.columns
+        groups = self.strings["group"].tolist()
+        suffixes = self.strings["suffix"].tolist()
+        n_groups = len(groups)
+        n_paths = max(len(self.strings["path"]), 1)
+        n_suffixes = max(len(suffixes), 1)
+
+        bundle_group = columns["bundle_group"]
+        bundle_size = columns["bundle_Size"]
+        is_internal = columns["bundle_IsInternal"]
+        total_size = np.bincount(bundle_group, weights=bundle_size, minlength=n_groups)
+        internal_size = np.bincount(bundle_group[is_internal], weights=bundle_size[is_internal], minlength=n_groups)
+
+        # 资源按路径去重计数: 对 (分组, 路径) 组合键去重
+        asset_group = bundle_group[columns["asset_bundle"]].astype(np.int64)
+        asset_path = columns["asset_path"].astype(np.int64)
+        asset_internal = is_internal[columns["asset_bundle"]]
+        group_path = np.unique(asset_group * n_paths + asset_path)
+        asset_count = np.bincount(group_path // n_paths, minlength=n_groups)
+        internal_path = np.unique(asset_group[asset_internal] * n_paths + asset_path[asset_internal])
+        internal_count = np.bincount(internal_path // n_paths, minlength=n_groups)
+
+        all_stats = [{'name': groups[g], 'count': int(asset_count[g]), 'total_size': int(total_size[g])}
+                     for g in range(n_groups)]
+        internal_stats = [{'name': groups[g], 'count': int(internal_count[g]), 'total_size': int(internal_size[g])}
+                          for g in range(n_groups)]
+
+        # 后缀统计按 (分组, 后缀) 在资源中首次出现的顺序输出
+        group_suffix = asset_group * n_suffixes + columns["asset_suffix"]
+        pairs, first_index = np.unique(group_suffix, return_index=True)
+        pairs = pairs[np.lexsort((first_index, pairs // n_suffixes))]
+        suffix_path, suffix_count = np.unique(np.unique(group_suffix * n_paths + asset_path) // n_paths,
+                                              return_counts=True)
+        suffix_counts = dict(zip(suffix_path.tolist(), suffix_count.tolist()))
+        suffix_stats = [{'name': f"{groups[pair // n_suffixes]}_{suffixes[pair % n_suffixes]}",
+                         'count': suffix_counts[pair], 'total_size': 0}
+                        for pair in pairs.tolist()]
+
+        return all_stats, internal_stats, suffix_stats
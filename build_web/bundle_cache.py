@@ -0,0 +1,330 @@
+"""
+Parsed bundle detail cache (per process, on top of the shared build cache),
+with warm-up of the latest builds.
+"""
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from pymongo import DESCENDING
+from .common_task import db, storage, get_all_build_targets, get_all_build_schemas
+from .bundle_info_deal import BundleInfoDeal, bundle_info_list_query
+from .bundle_trend_deal import split_info_id
+from .build_table import BuildTable, TABLE_FORMAT_VERSION
+from .project_setting import (MONGO_URI, MONGO_DB_NAME, STORAGE_BACKEND, LOCAL_STORAGE_DIR, BUNDLEINFO_COLLECTION, BUILD_CACHE_SIZE, WARMUP_BUILDS_PER_TARGET, WARMUP_WORKERS,
+                              WARMUP_MEMORY_BUDGET_MB, PARSED_SIZE_FACTOR, SHARED_BUILD_CACHE, SHARED_CACHE_DIR,
+                              SHARED_CACHE_MAX_BUILDS, PREFETCH_MAX_PENDING)
+
+class BuildLRUCache(object):
+    """LRU of loaded builds per process
+
+    Concurrent loads of one key run once while different keys load in
+    parallel. The per-key lock only exists while its load is in progress, and
+    missing builds (loader returned None) are not cached, so junk ids cannot
+    grow the lock table or push real builds out.
+    """
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.loading = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, loader):
+        with self.lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                self.hits += 1
+                return self.items[key]
+            entry = self.loading.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                with self.lock:
+                    if key in self.items:
+                        self.hits += 1
+                        return self.items[key]
+                    self.misses += 1
+                value = loader(key)
+                if value is not None:
+                    with self.lock:
+                        self.items[key] = value
+                        while len(self.items) > self.maxsize:
+                            self.items.popitem(last=False)
+                return value
+        finally:
+            with self.lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self.loading[key]
+
+    def contains(self, key) -> bool:
+        """Cached or being loaded"""
+        with self.lock:
+            return key in self.items or key in self.loading
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+    def info(self):
+        return {"hits": self.hits, "misses": self.misses, "maxsize": self.maxsize, "currsize": len(self.items)}
+
+
+def shared_cache_namespace() -> str:
+    """共享缓存子目录: 同一主机上连接不同数据库/存储的部署, 以及不同的表格式互不共享"""
+    source = [MONGO_URI, MONGO_DB_NAME, STORAGE_BACKEND, str(TABLE_FORMAT_VERSION)]
+    if STORAGE_BACKEND == "local":
+        source.append(os.path.abspath(LOCAL_STORAGE_DIR))
+    return hashlib.sha1("\n".join(source).encode("utf-8")).hexdigest()[:16]
+
+
+shared_cache = None
+if SHARED_BUILD_CACHE:
+    # 共享缓存依赖fcntl, 只在启用时导入
+    from .shared_build_cache import SharedBuildCache
+    shared_cache = SharedBuildCache(os.path.join(SHARED_CACHE_DIR, shared_cache_namespace()), SHARED_CACHE_MAX_BUILDS)
+
+# 缓存加载的bundle详情数据, 以及未启用共享缓存时的列式数据
+_bundle_details = BuildLRUCache(BUILD_CACHE_SIZE)
+_build_tables = BuildLRUCache(BUILD_CACHE_SIZE)
+
+
+def load_bundle_detail(info_id):
+    """Load build from storage; patch builds overlay their delta on the cached base build"""
+    return BundleInfoDeal().load_bundle_detail_info(info_id, base_loader=get_cached_bundle_detail)
+
+
+def get_build_table(info_id):
+    """列式的构建数据, 同一台机器上的所有worker共享一份; 未启用共享缓存时每个进程缓存一份"""
+    if shared_cache is not None:
+        return shared_cache.get(info_id, load_bundle_detail)
+    return _build_tables.get(info_id, _load_build_table)
+
+
+def _load_build_table(info_id):
+    data = get_cached_bundle_detail(info_id)
+    return BuildTable.from_bundle_info(data) if data is not None else None
+
+
+def _load_cached_bundle_detail(info_id):
+    if shared_cache is not None:
+        table = shared_cache.get(info_id, load_bundle_detail)
+        return table.to_bundle_info() if table is not None else None
+    return load_bundle_detail(info_id)
+
+
+def get_cached_bundle_detail(info_id):
+    """缓存bundle详情数据，减少重复加载; 同一个info_id的并发请求只加载一次"""
+    return _bundle_details.get(info_id, _load_cached_bundle_detail)
+
+
+def is_build_cached(info_id) -> bool:
+    """Build is cached (or being loaded) by this process, or published in the shared cache"""
+    if shared_cache is not None and shared_cache.contains(info_id):
+        return True
+    return _bundle_details.contains(info_id)
+
+
+def get_bundle_group_stats(info_id):
+    """分组统计, 启用共享缓存时直接在列式数据上计算"""
+    if shared_cache is not None:
+        table = get_build_table(info_id)
+        if table is None:
+            raise ValueError(f"Bundle info of {info_id} not found")
+        return table.group_stats()
+    data = get_cached_bundle_detail(info_id)
+    bundle_deal = BundleInfoDeal()
+    return bundle_deal.calculate_stats_from_grouped_data(bundle_deal.group_bundles(data))
+
+
+def get_group_details(info_id, group_type=None):
+    """分组详情; 启用共享缓存且指定分组时只从列式数据重建该分组的bundle"""
+    bundle_deal = BundleInfoDeal()
+    if shared_cache is not None and group_type:
+        table = get_build_table(info_id)
+        if table is None:
+            raise ValueError(f"Bundle info of {info_id} not found")
+        data = table.subset_bundle_info(table.group_bundle_indices(group_type))
+    else:
+        data = get_cached_bundle_detail(info_id)
+    return bundle_deal.get_enhanced_group_details(data, group_type)
+
+
+def get_bundle_assets_by_name(info_id, bundle_name):
+    """Assets of one bundle, None if the bundle is not found"""
+    if shared_cache is not None:
+        table = get_build_table(info_id)
+        if table is None:
+            raise ValueError(f"Bundle info of {info_id} not found")
+        index = table.bundle_index(bundle_name)
+        if index is None:
+            return None
+        data = table.subset_bundle_info([index])
+    else:
+        data = get_cached_bundle_detail(info_id)
+    return BundleInfoDeal().get_bundle_assets(data, bundle_name)
+
+
+def iter_bundles_by_path(info_id, path):
+    """Bundles whose file name or any asset path equals path, in build order"""
+    if shared_cache is not None:
+        table = get_build_table(info_id)
+        if table is None:
+            raise ValueError(f"Bundle info of {info_id} not found")
+        return (table.bundle_dict(int(i)) for i in table.path_bundle_indices(path))
+    data = get_cached_bundle_detail(info_id)
+    return (bundle for bundle in data.get("Bundles", [])
+            if bundle.get("FileName") == path
+            or any(asset.get("AssetPath") == path for asset in bundle.get("Assets", [])))
+
+
+def clear_bundle_cache():
+    _bundle_details.clear()
+    _build_tables.clear()
+
+
+def bundle_cache_info():
+    """Cache statistics of this process"""
+    return dict(_bundle_details.info(),
+                tables=_build_tables.info() if shared_cache is None else None,
+                shared=shared_cache.info() if shared_cache is not None else None)
+
+
+def estimate_build_memory(file_id):
+    """Estimate memory of a parsed build from its stored file length"""
+    return storage.length(file_id) * PARSED_SIZE_FACTOR if file_id else 0
+
+
+class CacheWarmer(object):
+    """Load the latest builds of every platform/schema into the cache in background threads"""
+    def __init__(self, builds_per_target=WARMUP_BUILDS_PER_TARGET, workers=WARMUP_WORKERS,
+                 memory_budget=WARMUP_MEMORY_BUDGET_MB * 1024 * 1024):
+        self.builds_per_target = builds_per_target
+        self.workers = workers
+        self.memory_budget = memory_budget
+        self.lock = threading.Lock()
+        self.thread = None
+        self.rerun = False
+        self.status = {"state": "idle"}
+        # 预加载(打开页面时的上一个构建, 上传的新构建)共用一个有界线程池
+        self.prefetch_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="build_web_prefetch")
+        self.prefetching = set()
+
+    def latest_builds(self):
+        """最近的构建, 按构建时间倒序, 不超过缓存容量"""
+        builds = []
+        collection = db[BUNDLEINFO_COLLECTION]
+        for platform in get_all_build_targets():
+            for schema in get_all_build_schemas():
+                cursor = collection.find(filter=bundle_info_list_query(platform, schema),
+                                         projection={"project": 1, "build_time": 1, "file_id": 1}) \
+                    .sort("build_time", DESCENDING).limit(self.builds_per_target)
+                builds.extend(cursor)
+        builds.sort(key=lambda doc: doc.get("build_time") or "", reverse=True)
+        return builds[:SHARED_CACHE_MAX_BUILDS if shared_cache is not None else BUILD_CACHE_SIZE]
+
+    def start(self):
+        """Start warm-up in background, re-running once if a warm-up is already in progress"""
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                self.rerun = True
+                return
+            self.thread = threading.Thread(target=self.run, name="build_web_warmup", daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while True:
+            try:
+                self.warm_up()
+            except Exception as e:
+                print(f"Cache warm-up failed: {e}")
+                self.status.update({"state": "error", "message": str(e)})
+            with self.lock:
+                if not self.rerun:
+                    return
+                self.rerun = False
+
+    def warm_up(self):
+        builds = self.latest_builds()
+        self.status = {
+            "state": "running",
+            "started_at": time.time(),
+            "total": len(builds),
+            "loaded": 0,
+            "skipped": 0,
+            "failed": 0,
+            "estimated_bytes": 0,
+            "memory_budget": self.memory_budget
+        }
+
+        # 按预算挑选要加载的构建, 超出预算的跳过
+        selected = []
+        for doc in builds:
+            estimated = estimate_build_memory(doc.get("file_id"))
+            if self.status["estimated_bytes"] + estimated > self.memory_budget:
+                self.status["skipped"] += 1
+                continue
+            self.status["estimated_bytes"] += estimated
+            selected.append(doc["project"])
+
+        print(f"Cache warm-up: loading {len(selected)} of {len(builds)} builds")
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="build_web_warmup") as executor:
+            for loaded in executor.map(self.load, selected):
+                self.status["loaded" if loaded else "failed"] += 1
+
+        self.status.update({"state": "done", "finished_at": time.time()})
+
+    def load(self, info_id):
+        try:
+            if shared_cache is not None:
+                return get_build_table(info_id) is not None
+            return get_cached_bundle_detail(info_id) is not None
+        except Exception as e:
+            print(f"Cache warm-up of {info_id} failed: {e}")
+            return False
+
+    def prefetch(self, info_id):
+        """Load build in the background unless it is cached, already queued or the queue is full"""
+        with self.lock:
+            if info_id in self.prefetching or len(self.prefetching) >= PREFETCH_MAX_PENDING:
+                return False
+            if is_build_cached(info_id):
+                return False
+            self.prefetching.add(info_id)
+        future = self.prefetch_executor.submit(self.load, info_id)
+        future.add_done_callback(lambda _: self._prefetch_done(info_id))
+        return True
+
+    def _prefetch_done(self, info_id):
+        with self.lock:
+            self.prefetching.discard(info_id)
+
+    def prefetch_previous(self, info_id):
+        """打开某个构建时预加载上一个构建, 用户通常会接着对比"""
+        try:
+            previous_id = find_previous_build(info_id)
+        except Exception as e:
+            print(f"Find previous build of {info_id} failed: {e}")
+            return None
+        if previous_id:
+            self.prefetch(previous_id)
+        return previous_id
+
+
+def find_previous_build(info_id):
+    """Find info ID of the previous build of the same platform/schema"""
+    parts = split_info_id(info_id)
+    if len(parts) != 4:
+        return None
+    _, platform, schema, build_time = parts
+    query = bundle_info_list_query(platform, schema)
+    query["build_time"] = {"$lt": build_time}
+    doc = db[BUNDLEINFO_COLLECTION].find_one(query, projection={"project": 1}, sort=[("build_time", DESCENDING)])
+    return doc["project"] if doc else None
+
+
+cache_warmer = CacheWarmer()
@@ -8,34 +8,141 @@ from collections import defaultdict
 import bisect
 import pandas as pd
 from bson import json_util
-from .common_task import BaseInfoDeal, save_file_to_gridfs, read_from_gridfs_by_info_id
+from .common_task import (db, BaseInfoDeal, save_file_to_gridfs, read_from_gridfs_by_info_id, read_from_gridfs,
+                          find_gridfs_file_by_hash, iter_from_collection, load_json_blob)
 from .project_setting import BUNDLEINFO_COLLECTION, METADATA_VERSION
 
 class BundleInfoDeal(BaseInfoDeal):
     def __init__(self):
         super().__init__(BUNDLEINFO_COLLECTION)
 
-    def save_bundle_info_to_collection(self, info_id: str, build_time: str):
-        """Save bundle info to collection"""
+    def save_bundle_info_to_collection(self, info_id: str, build_time: str, file_id=None, content_hash: str = None,
+                                       patch: dict = None):
+        """Save bundle info to collection, linked to its GridFS file (the delta blob for patch builds)"""
         data = {
             "project": info_id, 
             "build_time": build_time, 
+            "file_id": file_id,
+            "content_hash": content_hash,
             "metadata": {"version": METADATA_VERSION}
         }
+        if patch:
+            data["patch"] = patch
         return self.save_info_to_collection(data)
 
-    def save_bundle_info_to_gridfs(self, info_id: str, info_type: str, file_obj):
-        """Save bundle info to GridFS"""
-        gridfs_id = save_file_to_gridfs(info_id, info_type, file_obj)
+    def save_bundle_info_to_gridfs(self, info_id: str, info_type: str, file_obj, content_hash: str = None):
+        """Save bundle info to GridFS, reusing the stored file when the same content was uploaded before"""
+        if content_hash:
+            gridfs_id = find_gridfs_file_by_hash(content_hash)
+            if gridfs_id is not None:
+                print(f"Same content already stored, reuse gridfs file: {gridfs_id}")
+                return gridfs_id
+
+        gridfs_id = save_file_to_gridfs(info_id, info_type, file_obj, content_hash)
         print(f"Save to gridfs success, ID: {gridfs_id}")
         return gridfs_id
 
-    def load_bundle_detail_info(self, info_id: str):
-        """Load bundle detail info from GridFS"""
-        grid_files = read_from_gridfs_by_info_id(info_id)
-        grid_file = grid_files[0] if grid_files else None
-        if grid_file:
-            return json.loads(grid_file.read().decode('utf-8-sig'))
+    def get_bundle_info_doc(self, info_id: str):
+        """Get collection doc of the build"""
+        return db[self.collection_name].find_one({"project": info_id})
+
+    def load_bundle_detail_info(self, info_id: str, base_loader=None):
+        """Load bundle detail info from storage
+
+        Patch builds store only a delta; the full view is rebuilt by overlaying
+        it on the base build, loaded through base_loader (e.g. the cache).
+        """
+        doc = self.get_bundle_info_doc(info_id)
+        if doc and doc.get("file_id"):
+            _, data = read_from_gridfs(doc["file_id"])
+            data = load_json_blob(data)
+            if doc.get("patch"):
+                base_loader = base_loader or self.load_bundle_detail_info
+                base_data = base_loader(doc["patch"]["base_info_id"])
+                if base_data is None:
+                    raise ValueError(f"Base build {doc['patch']['base_info_id']} of patch {info_id} not found")
+                return self.apply_patch_delta(base_data, data)
+            return data
+
+        # 旧数据没有记录file_id, 按info_id查询最新上传的文件
+        data = read_from_gridfs_by_info_id(info_id)
+        if data is not None:
+            return load_json_blob(data)
+        return None
+
+    def build_patch_delta(self, base_data: dict, data: dict) -> dict:
+        """对比基础构建, 只保留变化/新增的bundle和被删除的bundle名 (以FileName为键)
+
+        A bundle counts as changed when any of its fields differs (DownloadVersion,
+        Labels, IsInternal ...), so overlaying the delta reproduces the upload.
+        Bundles whose XXHash changed are listed separately: only those have to
+        be downloaded again.
+        """
+        base_bundles = {bundle.get("FileName"): bundle for bundle in base_data.get("Bundles", [])}
+        names = set()
+        changed = []
+        content_changed = []
+        added = []
+        for bundle in data.get("Bundles", []):
+            name = bundle.get("FileName")
+            names.add(name)
+            base_bundle = base_bundles.get(name)
+            if base_bundle is None:
+                added.append(bundle)
+            elif base_bundle != bundle:
+                changed.append(bundle)
+                if base_bundle.get("XXHash") != bundle.get("XXHash"):
+                    content_changed.append(name)
+        removed = [name for name in base_bundles if name not in names]
+
+        delta = {key: value for key, value in data.items() if key != "Bundles"}
+        delta.update({"ChangedBundles": changed, "ContentChangedBundles": content_changed,
+                      "AddedBundles": added, "RemovedBundles": removed})
+        return delta
+
+    def apply_patch_delta(self, base_data: dict, delta: dict) -> dict:
+        """Overlay patch delta on base build; base data is not modified"""
+        changed = {bundle.get("FileName"): bundle for bundle in delta.get("ChangedBundles", [])}
+        removed = set(delta.get("RemovedBundles", []))
+        bundles = [changed.get(bundle.get("FileName"), bundle) for bundle in base_data.get("Bundles", [])
+                   if bundle.get("FileName") not in removed]
+        bundles.extend(delta.get("AddedBundles", []))
+
+        data = {key: value for key, value in delta.items()
+                if key not in ("ChangedBundles", "ContentChangedBundles", "AddedBundles", "RemovedBundles")}
+        data["Bundles"] = bundles
+        return data
+
+    def patch_summary(self, base_info_id: str, delta: dict) -> dict:
+        """Patch summary stored with the build, download size is the size of re-built and added bundles"""
+        changed = delta.get("ChangedBundles", [])
+        if "ContentChangedBundles" in delta:
+            content_changed = set(delta["ContentChangedBundles"])
+            download_bundles = [bundle for bundle in changed if bundle.get("FileName") in content_changed]
+        else:
+            download_bundles = changed
+        patch_bundles = download_bundles + delta.get("AddedBundles", [])
+        return {
+            "base_info_id": base_info_id,
+            "changed": len(changed),
+            "content_changed": len(download_bundles),
+            "added": len(delta.get("AddedBundles", [])),
+            "removed": len(delta.get("RemovedBundles", [])),
+            "download_size": sum(bundle.get("Size", 0) for bundle in patch_bundles),
+            "download_size_external": sum(bundle.get("Size", 0) for bundle in patch_bundles
+                                          if not bundle.get("IsInternal", False))
+        }
+
+    def get_bundle_assets(self, data, bundle_name):
+        """Get asset list of the bundle with given file name, None if not found"""
+        for bundle in data.get("Bundles", []):
+            if bundle.get("FileName") == bundle_name:
+                return [{
+                    "AssetPath": asset.get("AssetPath"),
+                    "Hash": asset.get("Hash"),
+                    "Size": asset.get("Size"),
+                    "Type": asset.get("Type")
+                } for asset in bundle.get("Assets", [])]
         return None
 
     def group_process_bundles(self, data):
@@ -215,18 +322,26 @@ class BundleInfoDeal(BaseInfoDeal):
     #
     #     return distribution, LABELS
 
-def get_bundle_info_list(platform, schema):
-    """Get bundle info list by platform and schema"""
-    bundle_deal = BundleInfoDeal()
-    query = {
+def bundle_info_list_query(platform, schema):
+    """Query of bundle infos by platform and schema"""
+    return {
         "project": {
             "$regex": f"^l22_{platform}_{schema}_",
             "$options": "i"
         }
     }
-    bundle_deal.read_info_from_collection(query)
+
+def get_bundle_info_list(platform, schema):
+    """Get bundle info list by platform and schema"""
+    bundle_deal = BundleInfoDeal()
+    bundle_deal.read_info_from_collection(bundle_info_list_query(platform, schema))
     return json.loads(json_util.dumps(bundle_deal.info_list))
 
+def iter_bundle_info_list(platform, schema, fields=None, limit=0):
+    """Lazily iterate bundle info list from the Mongo cursor"""
+    projection = {field: 1 for field in fields} if fields else None
+    return iter_from_collection(BUNDLEINFO_COLLECTION, bundle_info_list_query(platform, schema), projection, limit)
+
 # def prepare_distribution_size_chart_data(info_id):
 #     """Prepare chart data for size distribution"""
 #     print("Time1: " + time.ctime())
@@ -0,0 +1,130 @@
+"""
+Cross-build trend rollups.
+"""
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import ConnectionFailure, PyMongoError
+from .common_task import BaseInfoDeal, db
+from .bundle_info_deal import BundleInfoDeal
+from .project_setting import BUNDLE_ROLLUP_COLLECTION, METADATA_VERSION, TREND_GROWTH_THRESHOLD, TREND_DEFAULT_LIMIT
+
+
+def split_info_id(info_id: str):
+    """Split info ID into (project, platform, schema, build_time)"""
+    return tuple(info_id.split("_", 3))
+
+
+class BundleTrendDeal(BaseInfoDeal):
+    def __init__(self):
+        super().__init__(BUNDLE_ROLLUP_COLLECTION)
+
+    def build_rollup(self, info_id: str, platform: str, schema: str, build_time: str, data: dict) -> dict:
+        """根据完整的bundle数据生成紧凑的单构建汇总"""
+        bundle_deal = BundleInfoDeal()
+        grouped_data = bundle_deal.group_bundles(data)
+        all_stats, internal_stats, _ = bundle_deal.calculate_stats_from_grouped_data(grouped_data)
+        internal_sizes = {stats["name"]: stats["total_size"] for stats in internal_stats}
+
+        groups = [{
+            "name": stats["name"],
+            "total_size": stats["total_size"],
+            "internal_size": internal_sizes.get(stats["name"], 0),
+            "asset_count": stats["count"],
+            "bundle_count": len(grouped_data[stats["name"]])
+        } for stats in all_stats]
+
+        return {
+            "project": info_id,
+            "platform": platform,
+            "schema": schema,
+            "build_time": build_time,
+            "total_size": sum(group["total_size"] for group in groups),
+            "groups": groups,
+            "metadata": {"version": METADATA_VERSION}
+        }
+
+    def save_rollup_to_collection(self, rollup: dict):
+        """Save rollup to collection, replacing any previous rollup of the same build"""
+        try:
+            collection = db[self.collection_name]
+            collection.create_index("project", unique=True)
+            collection.create_index([("platform", ASCENDING), ("schema", ASCENDING), ("build_time", ASCENDING)])
+            collection.replace_one({"project": rollup["project"]}, rollup, upsert=True)
+            return True, rollup["project"]
+
+        except ConnectionFailure as e:
+            print(f"Connection failed: {e}")
+            raise
+        except PyMongoError as e:
+            print(f"MongoDB operation failed: {e}")
+            raise
+
+    def read_rollups(self, platform: str, schema: str, since: str = None, limit=TREND_DEFAULT_LIMIT) -> list:
+        """按 (platform, schema, build_time) 索引范围扫描汇总记录, 返回最近的limit个构建(按时间升序)"""
+        query = {"platform": platform, "schema": schema}
+        if since:
+            query["build_time"] = {"$gte": since}
+
+        collection = db[self.collection_name]
+        cursor = collection.find(filter=query, projection={"_id": 0}) \
+            .sort("build_time", DESCENDING).limit(limit)
+        rollups = list(cursor)
+        rollups.reverse()
+        self.info_list = rollups
+        return rollups
+
+    def get_trends(self, platform: str, schema: str, since: str = None,
+                   limit=TREND_DEFAULT_LIMIT, threshold=TREND_GROWTH_THRESHOLD) -> dict:
+        """Get per group time series and growth flags"""
+        rollups = self.read_rollups(platform, schema, since, limit)
+        return self.build_trends(rollups, threshold)
+
+    def build_trends(self, rollups: list, threshold=TREND_GROWTH_THRESHOLD) -> dict:
+        """将按时间升序的汇总记录转换为分组时间序列, 并标记增长超过阈值的构建"""
+        group_names = sorted({group["name"] for rollup in rollups for group in rollup["groups"]})
+        series = {name: {"total_size": [], "internal_size": [], "asset_count": []} for name in group_names}
+        flags = []
+
+        previous_sizes = {}
+        for rollup in rollups:
+            groups = {group["name"]: group for group in rollup["groups"]}
+            for name in group_names:
+                group = groups.get(name, {})
+                total_size = group.get("total_size", 0)
+                series[name]["total_size"].append(total_size)
+                series[name]["internal_size"].append(group.get("internal_size", 0))
+                series[name]["asset_count"].append(group.get("asset_count", 0))
+
+                # 与上一个构建比较, 增长超过阈值时标记; 第一个构建没有比较基准
+                # 上一个构建中不存在(大小为0)的分组出现时也标记, growth为None(无穷大不能输出为JSON)
+                if name in previous_sizes:
+                    previous_size = previous_sizes[name]
+                    new_group = previous_size == 0 and total_size > 0
+                    growth = (total_size - previous_size) / previous_size if previous_size > 0 else None
+                    if new_group or (growth is not None and growth > threshold):
+                        flags.append({
+                            "project": rollup["project"],
+                            "build_time": rollup["build_time"],
+                            "group": name,
+                            "previous_size": previous_size,
+                            "total_size": total_size,
+                            "growth": growth,
+                            "new_group": new_group
+                        })
+                previous_sizes[name] = total_size
+
+        return {
+            "builds": [rollup["project"] for rollup in rollups],
+            "build_times": [rollup["build_time"] for rollup in rollups],
+            "total_size": [rollup["total_size"] for rollup in rollups],
+            "groups": series,
+            "flags": flags,
+            "threshold": threshold
+        }
+
+
+def build_upload_rollup(info_id: str, platform: str, schema: str, build_time: str, data) -> dict:
+    """Rollup of an uploaded build, built before anything is stored; ValueError if the build is malformed"""
+    try:
+        return BundleTrendDeal().build_rollup(info_id, platform, schema, build_time, data)
+    except (KeyError, TypeError, AttributeError) as e:
+        raise ValueError(f"Malformed bundle info: {type(e).__name__} {e}")
@@ -11,22 +11,24 @@ class DLCInfoDeal(BaseInfoDeal):
         super().__init__(DLC_COLLECTION)
         self.dlc_design_map_collect_name = DLC_DESIGN_MAP_COLLECTION
 
-    def save_dlc_info_to_collection(self, info_id: str, build_time: str, dlcs: dict):
+    def save_dlc_info_to_collection(self, info_id: str, build_time: str, dlcs: dict, content_hash: str = None):
         """Save DLC info to collection"""
         data = {
             "project": info_id, 
             "build_time": build_time, 
             "dlcs": dlcs, 
+            "content_hash": content_hash,
             "metadata": {"version": METADATA_VERSION}
         }
         return self.save_info_to_collection(data)
 
-    def save_dlc_design_map_to_collection(self, info_id: str, build_time: str, dlcs: dict):
+    def save_dlc_design_map_to_collection(self, info_id: str, build_time: str, dlcs: dict, content_hash: str = None):
         """Save DLC design map to collection"""
         data = {
             "project": info_id, 
             "build_time": build_time, 
             "dlcs": dlcs, 
+            "content_hash": content_hash,
             "metadata": {"version": METADATA_VERSION}
         }
         return save_to_collection(self.dlc_design_map_collect_name, data)
@@ -0,0 +1,139 @@
+"""
+Label / DLC download set calculation.
+
+Each label and DLC group maps to the set of bundle indices carrying it. Sets
+are kept roaring-style: labels covering many bundles as packed bitsets, the
+(very common) labels covering only a few bundles as sorted index arrays. The
+download size of any combination is a bitwise OR of its sets followed by a
+masked sum over the bundle sizes.
+"""
+import threading
+import weakref
+from collections import defaultdict
+import numpy as np
+
+
+class BundleSets(object):
+    """Bundle index sets of every string in a Labels/DlcGroups list column"""
+    def __init__(self, table, list_name: str, table_name: str):
+        self.bundle_count = table.bundle_count
+        offsets = table.columns[f"{list_name}_offsets"]
+        codes = np.asarray(table.columns[f"{list_name}_codes"])
+        self.names = {name: code for code, name in enumerate(table.strings[table_name].tolist())}
+
+        # 按编码排序后得到每个字符串对应的bundle下标(CSR)
+        entry_bundle = np.repeat(np.arange(self.bundle_count, dtype=np.int32), np.diff(offsets))
+        order = np.argsort(codes, kind="stable")
+        self.postings = entry_bundle[order]
+        self.pointers = np.zeros(len(self.names) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(codes, minlength=len(self.names)), out=self.pointers[1:])
+
+        # 位图比下标数组更小时使用压缩位图
+        dense_threshold = max(self.bundle_count // 32, 1)
+        counts = np.diff(self.pointers)
+        self.dense = {}
+        for code in np.flatnonzero(counts > dense_threshold).tolist():
+            mask = np.zeros(self.bundle_count, dtype=bool)
+            mask[self.postings[self.pointers[code]:self.pointers[code + 1]]] = True
+            self.dense[code] = np.packbits(mask)
+
+    def union(self, names, mask: np.ndarray):
+        """OR the sets of names into bundle mask, returns names not found"""
+        bits = None
+        sparse = []
+        unknown = []
+        for name in names:
+            code = self.names.get(name)
+            if code is None:
+                unknown.append(name)
+            elif code in self.dense:
+                bits = self.dense[code].copy() if bits is None else np.bitwise_or(bits, self.dense[code], out=bits)
+            else:
+                sparse.append(self.postings[self.pointers[code]:self.pointers[code + 1]])
+        if bits is not None:
+            mask |= np.unpackbits(bits, count=self.bundle_count).astype(bool)
+        if sparse:
+            mask[np.concatenate(sparse)] = True
+        return unknown
+
+
+class DownloadSetIndex(object):
+    """Per build index answering "how many bytes for this set of labels/DLC groups" """
+    def __init__(self, table):
+        self.table = table
+        self.labels = BundleSets(table, "label", "label")
+        self.dlc_groups = BundleSets(table, "dlc", "dlc_group")
+        self.sizes = np.asarray(table.columns["bundle_Size"])
+        self.is_internal = np.asarray(table.columns["bundle_IsInternal"])
+
+        # LabelInfos: 设计表 -> 标签
+        self.design_table_labels = defaultdict(list)
+        for label_info in table.extra.get("LabelInfos", []):
+            for design_table in label_info.get("DesignTables", []):
+                self.design_table_labels[design_table].append(label_info.get("Label"))
+
+    def calculate(self, labels=(), dlc_groups=(), design_tables=(), include_internal=False) -> dict:
+        """Download size of the union of bundles carrying any of the given labels/DLC groups/design tables"""
+        mask = np.zeros(self.table.bundle_count, dtype=bool)
+        unknown_tables = [name for name in design_tables if name not in self.design_table_labels]
+        table_labels = [label for name in design_tables for label in self.design_table_labels.get(name, [])]
+        unknown_labels = self.labels.union(list(labels) + table_labels, mask)
+        unknown_dlc_groups = self.dlc_groups.union(dlc_groups, mask)
+
+        # 包内(IsInternal)的bundle随安装包下发, 默认不计入下载量
+        if not include_internal:
+            mask &= ~self.is_internal
+
+        return {
+            "bundle_count": int(mask.sum()),
+            "download_size": int(self.sizes[mask].sum()),
+            "unknown_labels": unknown_labels,
+            "unknown_dlc_groups": list(unknown_dlc_groups),
+            "unknown_design_tables": unknown_tables
+        }
+
+    def calculate_batch(self, combinations: list, include_internal=False) -> list:
+        """Evaluate many combinations against the same index"""
+        return [dict(self.calculate(combination.get("labels", []),
+                                    combination.get("dlc_groups", []),
+                                    combination.get("design_tables", []),
+                                    combination.get("include_internal", include_internal)),
+                     name=combination.get("name"))
+                for combination in combinations]
+
+
+COMBINATION_LIST_FIELDS = ("labels", "dlc_groups", "design_tables")
+
+
+def validate_combinations(combinations) -> list:
+    """Errors of invalid combinations as {"index", "name", "message"}, empty if all are valid"""
+    if not isinstance(combinations, list):
+        return [{"index": None, "name": None, "message": "combinations must be a list"}]
+    errors = []
+    for index, combination in enumerate(combinations):
+        if not isinstance(combination, dict):
+            errors.append({"index": index, "name": None, "message": "combination must be an object"})
+            continue
+        for field in COMBINATION_LIST_FIELDS:
+            values = combination.get(field, [])
+            if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+                errors.append({"index": index, "name": combination.get("name"),
+                               "message": f"{field} must be a list of strings"})
+        if not isinstance(combination.get("include_internal", False), bool):
+            errors.append({"index": index, "name": combination.get("name"),
+                           "message": "include_internal must be a boolean"})
+    return errors
+
+
+_indexes = weakref.WeakKeyDictionary()
+_indexes_lock = threading.Lock()
+
+
+def get_download_set_index(table) -> DownloadSetIndex:
+    """Download set index of the table, built once per table"""
+    with _indexes_lock:
+        index = _indexes.get(table)
+        if index is None:
+            index = DownloadSetIndex(table)
+            _indexes[table] = index
+        return index
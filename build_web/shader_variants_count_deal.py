@@ -1,19 +1,22 @@
 """
 Shader variants information processing.
 """
+from functools import lru_cache
+import pandas as pd
 from .common_task import BaseInfoDeal,read_from_collection
-from .project_setting import SHADERVARIANT_COLLECTION, METADATA_VERSION
+from .project_setting import SHADERVARIANT_COLLECTION, METADATA_VERSION, SHADER_DIFF_CACHE_SIZE
 
 class ShaderVariantsDeal(BaseInfoDeal):
     def __init__(self):
         super().__init__(SHADERVARIANT_COLLECTION)
 
-    def save_shader_variants_to_collection(self, info_id: str, build_time: str, variants: dict):
+    def save_shader_variants_to_collection(self, info_id: str, build_time: str, variants: dict, content_hash: str = None):
         """Save shader variants to collection"""
         data = {
             "project": info_id, 
             "build_time": build_time, 
             "variants": variants, 
+            "content_hash": content_hash,
             "metadata": {"version": METADATA_VERSION}
         }
         return self.save_info_to_collection(data)
@@ -46,4 +49,63 @@ class ShaderVariantsDeal(BaseInfoDeal):
                 "$options": "i"
             }
         }
-        return self.get_shader_variants_from_collection(query)
\ No newline at end of file
+        return self.get_shader_variants_from_collection(query)
+
+    def get_shader_variants(self, info_id: str, platform: str):
+        """Get {shader: variant_count} of one platform of a build, None if not uploaded"""
+        results = read_from_collection(
+            collection_name=self.collection_name,
+            query={"project": info_id},
+            limit=1
+        )
+        if len(results) == 0:
+            return None
+        return results[0].get("variants", {}).get(platform)
+
+    def diff_shader_variants(self, base_info_id: str, base_platform: str, target_info_id: str, target_platform: str):
+        """Compare shader variants of two (build, platform) pairs"""
+        base = self.get_shader_variants(base_info_id, base_platform)
+        target = self.get_shader_variants(target_info_id, target_platform)
+        if base is None:
+            raise ValueError(f"Shader variants of {base_info_id} ({base_platform}) not found")
+        if target is None:
+            raise ValueError(f"Shader variants of {target_info_id} ({target_platform}) not found")
+        return build_shader_variants_diff(base, target)
+
+
+def build_shader_variants_diff(base: dict, target: dict) -> dict:
+    """按shader名做外连接, 计算新增/删除/变化的shader和变体数差值, 按影响大小排序"""
+    df = pd.concat([pd.Series(base, name="base", dtype="int64"),
+                    pd.Series(target, name="target", dtype="int64")], axis=1, join="outer")
+    df["in_base"] = df["base"].notna()
+    df["in_target"] = df["target"].notna()
+    df[["base", "target"]] = df[["base", "target"]].fillna(0).astype("int64")
+    df["delta"] = df["target"] - df["base"]
+    df = df.iloc[(-df["delta"].abs()).argsort(kind="stable")]
+    in_base = df["in_base"]
+    in_target = df["in_target"]
+
+    def rows(frame):
+        return [{"shader": shader, "base": int(row.base), "target": int(row.target), "delta": int(row.delta)}
+                for shader, row in zip(frame.index, frame.itertuples(index=False))]
+
+    added = df[in_target & ~in_base]
+    removed = df[in_base & ~in_target]
+    changed = df[in_base & in_target & (df["delta"] != 0)]
+    return {
+        "total_base": int(df["base"].sum()),
+        "total_target": int(df["target"].sum()),
+        "total_delta": int(df["delta"].sum()),
+        "shader_count_base": int(in_base.sum()),
+        "shader_count_target": int(in_target.sum()),
+        "added": rows(added),
+        "removed": rows(removed),
+        "changed": rows(changed)
+    }
+
+
+@lru_cache(maxsize=SHADER_DIFF_CACHE_SIZE)
+def get_cached_shader_variants_diff(base_info_id: str, base_platform: str, target_info_id: str, target_platform: str):
+    """Shader variant diff cached per pair; uploaded shader variants never change"""
+    shader_deal = ShaderVariantsDeal()
+    return shader_deal.diff_shader_variants(base_info_id, base_platform, target_info_id, target_platform)
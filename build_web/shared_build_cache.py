@@ -0,0 +1,164 @@
+"""
+Build cache shared by all worker processes on one host.
+
+Each parsed build is saved once as a BuildTable directory under the shared
+cache root (tmpfs /dev/shm by default) and memory-mapped read-only by every
+worker. A small registry file, guarded by flock, records the cached builds and
+their last access time so eviction is coordinated across workers.
+"""
+import fcntl
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from .build_table import BuildTable
+
+
+class SharedBuildCache(object):
+    def __init__(self, root: str, max_builds: int, touch_interval=5.0):
+        self.root = root
+        self.max_builds = max_builds
+        self.touch_interval = touch_interval
+        self.builds_dir = os.path.join(root, "builds")
+        self.locks_dir = os.path.join(root, "locks")
+        self.registry_path = os.path.join(root, "registry.json")
+        os.makedirs(self.builds_dir, exist_ok=True)
+        os.makedirs(self.locks_dir, exist_ok=True)
+        self.attached = OrderedDict()
+        self.touched = {}
+        self.local_lock = threading.Lock()
+        self.stats = {"hits": 0, "attaches": 0, "builds": 0, "evictions": 0}
+
+    def _key(self, info_id: str):
+        return re.sub(r"[^A-Za-z0-9_.-]", "_", info_id)
+
+    def _build_dir(self, info_id: str):
+        return os.path.join(self.builds_dir, self._key(info_id))
+
+    def _lock_path(self, info_id: str):
+        return os.path.join(self.locks_dir, f"{self._key(info_id)}.lock")
+
+    @contextmanager
+    def _flock(self, path, blocking=True):
+        """跨进程排它锁; 非阻塞模式下锁被占用时返回False"""
+        with open(path, "a+") as f:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _read_registry(self):
+        try:
+            with open(self.registry_path, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _write_registry(self, registry):
+        tmp_path = f"{self.registry_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(registry, f)
+        os.replace(tmp_path, self.registry_path)
+
+    def contains(self, info_id: str) -> bool:
+        """Build is published in the shared cache"""
+        return os.path.isdir(self._build_dir(info_id))
+
+    def get(self, info_id: str, loader):
+        """Get shared table of info_id, building it with loader(info_id) on first use by any worker"""
+        build_dir = self._build_dir(info_id)
+        with self.local_lock:
+            table = self.attached.get(info_id)
+            if table is not None and os.path.isdir(build_dir):
+                self.attached.move_to_end(info_id)
+                self.stats["hits"] += 1
+                self._touch(info_id)
+                return table
+            self.attached.pop(info_id, None)
+
+        # 每个build一个锁文件, 保证所有worker中只有一个在解析同一个构建
+        with self._flock(self._lock_path(info_id)):
+            if not os.path.isdir(build_dir):
+                data = loader(info_id)
+                if data is None:
+                    return None
+                self._publish(info_id, BuildTable.from_bundle_info(data))
+            table = BuildTable.load(build_dir)
+
+        with self.local_lock:
+            self.stats["attaches"] += 1
+            self.attached[info_id] = table
+            while len(self.attached) > self.max_builds:
+                self.attached.popitem(last=False)
+        self._touch(info_id, force=True)
+        return table
+
+    def _publish(self, info_id: str, table: BuildTable):
+        build_dir = self._build_dir(info_id)
+        tmp_dir = f"{build_dir}.{os.getpid()}.{threading.get_ident()}.tmp"
+        table.save(tmp_dir)
+        os.rename(tmp_dir, build_dir)
+        self.stats["builds"] += 1
+        print(f"Shared build cache: published {info_id}")
+
+        with self._flock(self.registry_path + ".lock"):
+            registry = self._read_registry()
+            registry[info_id] = {"last_access": time.time(), "bytes": directory_size(build_dir)}
+            self._evict(registry, keep=info_id)
+            self._write_registry(registry)
+
+    def _evict(self, registry, keep: str):
+        """淘汰最久未访问的构建; 已映射的worker在文件删除后仍可继续读取
+
+        Each build is removed only while holding its build lock, so no worker is
+        in the middle of loading it. Builds whose lock is busy are skipped (a
+        blocking wait here, under the registry lock, could deadlock with a
+        worker publishing that build) and evicted by a later publish instead.
+        """
+        for info_id in [info_id for info_id in registry if not os.path.isdir(self._build_dir(info_id))]:
+            del registry[info_id]
+        candidates = sorted((key for key in registry if key != keep), key=lambda key: registry[key]["last_access"])
+        for oldest in candidates:
+            if len(registry) <= self.max_builds:
+                break
+            with self._flock(self._lock_path(oldest), blocking=False) as locked:
+                if not locked:
+                    continue
+                shutil.rmtree(self._build_dir(oldest), ignore_errors=True)
+            del registry[oldest]
+            self.stats["evictions"] += 1
+            print(f"Shared build cache: evicted {oldest}")
+
+    def _touch(self, info_id: str, force=False):
+        """Record access time in the registry, at most once per touch_interval per build"""
+        now = time.time()
+        if not force and now - self.touched.get(info_id, 0) < self.touch_interval:
+            return
+        self.touched[info_id] = now
+        with self._flock(self.registry_path + ".lock"):
+            registry = self._read_registry()
+            if info_id in registry:
+                registry[info_id]["last_access"] = now
+                self._write_registry(registry)
+
+    def info(self):
+        """Cache statistics of this worker plus the shared registry"""
+        registry = self._read_registry()
+        return dict(self.stats,
+                    attached=len(self.attached),
+                    shared_builds=len(registry),
+                    shared_bytes=sum(entry.get("bytes", 0) for entry in registry.values()),
+                    max_builds=self.max_builds)
+
+
+def directory_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
@@ -0,0 +1,187 @@
+"""
+Artifact storage backends for uploaded blobs (GridFS or local memory-mapped files).
+"""
+import json
+import mmap
+import os
+import re
+import threading
+import time
+import gridfs
+from bson import ObjectId
+
+
+class StorageBackend(object):
+    """Base class for all artifact storage backends"""
+    def put(self, data, info_id: str, info_type: str, content_hash: str = None):
+        """Store blob and return its file ID"""
+        raise NotImplementedError
+
+    def get(self, file_id):
+        """Return (info_id, buffer) of stored blob"""
+        raise NotImplementedError
+
+    def find_by_info_id(self, info_id: str):
+        """Return file ID of the newest blob uploaded for info_id, None if not found"""
+        raise NotImplementedError
+
+    def find_by_hash(self, content_hash: str):
+        """Return file ID of the blob with given content hash, None if content is new"""
+        raise NotImplementedError
+
+    def length(self, file_id) -> int:
+        """Return stored blob size in bytes, 0 if not found"""
+        raise NotImplementedError
+
+    def delete(self, file_id):
+        """Delete stored blob"""
+        raise NotImplementedError
+
+
+class GridFSStorage(StorageBackend):
+    """Blobs stored in MongoDB GridFS"""
+    def __init__(self, db):
+        self.db = db
+        self.fs = gridfs.GridFS(db)
+
+    def put(self, data, info_id: str, info_type: str, content_hash: str = None):
+        return self.fs.put(
+            data,
+            filename=str(time.time()) + "BundleInfos_Normal.json",
+            content_type='application/json',
+            metadata={"info_id": info_id, "info_type": info_type, "content_hash": content_hash}
+        )
+
+    def get(self, file_id):
+        grid_file = self.fs.get(file_id)
+        return grid_file.metadata["info_id"], grid_file.read()
+
+    def find_by_info_id(self, info_id: str):
+        grid_file = self.db.fs.files.find_one({"metadata.info_id": info_id}, projection={"_id": 1},
+                                              sort=[("uploadDate", -1)])
+        return grid_file["_id"] if grid_file else None
+
+    def find_by_hash(self, content_hash: str):
+        self.db.fs.files.create_index("metadata.content_hash")
+        grid_file = self.db.fs.files.find_one({"metadata.content_hash": content_hash}, projection={"_id": 1})
+        return grid_file["_id"] if grid_file else None
+
+    def length(self, file_id) -> int:
+        grid_file = self.db.fs.files.find_one({"_id": file_id}, projection={"length": 1})
+        return grid_file["length"] if grid_file else 0
+
+    def delete(self, file_id):
+        self.fs.delete(file_id)
+
+
+class LocalMmapStorage(StorageBackend):
+    """Blobs stored as local files and served through read-only mmap
+
+    Layout under root:
+        blobs/<file_id>.json       blob content
+        blobs/<file_id>.meta.json  metadata
+        by_hash/<content_hash>     file ID of the blob with that content
+        by_info_id/<info_id>       file ID of the newest blob of that build (info_id sanitized)
+    """
+    def __init__(self, root: str):
+        self.root = root
+        for sub_dir in ("blobs", "by_hash", "by_info_id"):
+            os.makedirs(os.path.join(root, sub_dir), exist_ok=True)
+
+    def _blob_path(self, file_id):
+        return os.path.join(self.root, "blobs", f"{file_id}.json")
+
+    def _meta_path(self, file_id):
+        return os.path.join(self.root, "blobs", f"{file_id}.meta.json")
+
+    def _info_id_path(self, info_id: str):
+        # info_id来自请求参数, 替换掉路径分隔符等字符, 防止写到by_info_id目录之外
+        return os.path.join(self.root, "by_info_id", re.sub(r"[^A-Za-z0-9_.-]", "_", info_id))
+
+    def _write_atomic(self, path, data: bytes):
+        # 同一进程的多个线程可能同时写同一个引用(相同内容的并发上传), 临时文件名加上线程ID
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                if hasattr(data, "read"):
+                    while True:
+                        chunk = data.read(1 << 20)
+                        if not chunk:
+                            break
+                        f.write(chunk)
+                else:
+                    f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _read_ref(self, path):
+        try:
+            with open(path, "r") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def put(self, data, info_id: str, info_type: str, content_hash: str = None):
+        file_id = str(ObjectId())
+        self._write_atomic(self._blob_path(file_id), data)
+        meta = {"info_id": info_id, "info_type": info_type, "content_hash": content_hash, "upload_time": time.time()}
+        self._write_atomic(self._meta_path(file_id), json.dumps(meta).encode("utf-8"))
+        if content_hash:
+            self._write_atomic(os.path.join(self.root, "by_hash", content_hash), file_id.encode("utf-8"))
+        if info_id:
+            self._write_atomic(self._info_id_path(info_id), file_id.encode("utf-8"))
+        return file_id
+
+    def get(self, file_id):
+        with open(self._meta_path(file_id), "r") as f:
+            info_id = json.load(f)["info_id"]
+        with open(self._blob_path(file_id), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return info_id, b""
+            # 只读映射, 解析时直接从页缓存读取, 不额外复制一份bytes
+            return info_id, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def find_by_info_id(self, info_id: str):
+        return self._read_ref(self._info_id_path(info_id))
+
+    def find_by_hash(self, content_hash: str):
+        file_id = self._read_ref(os.path.join(self.root, "by_hash", content_hash))
+        return file_id if file_id and os.path.exists(self._blob_path(file_id)) else None
+
+    def length(self, file_id) -> int:
+        try:
+            return os.path.getsize(self._blob_path(str(file_id)))
+        except OSError:
+            return 0
+
+    def delete(self, file_id):
+        file_id = str(file_id)
+        try:
+            with open(self._meta_path(file_id), "r") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = {}
+        # 只删除仍指向该文件的引用, 之后上传的同内容/同构建文件不受影响
+        ref_paths = []
+        if meta.get("content_hash"):
+            ref_paths.append(os.path.join(self.root, "by_hash", meta["content_hash"]))
+        if meta.get("info_id"):
+            ref_paths.append(self._info_id_path(meta["info_id"]))
+        for path in ref_paths:
+            if self._read_ref(path) == file_id:
+                os.remove(path)
+        for path in (self._blob_path(file_id), self._meta_path(file_id)):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def create_storage_backend(name: str, db=None, root: str = None) -> StorageBackend:
+    """Create storage backend by name ("gridfs" or "local")"""
+    if name == "gridfs":
+        return GridFSStorage(db)
+    if name == "local":
+        return LocalMmapStorage(root)
+    raise ValueError(f"Unknown storage backend: {name}")
@@ -2,23 +2,30 @@
 Routes and views for the flask application.
 """
 import json
-from functools import lru_cache
+from itertools import islice
 from flask import request, jsonify, render_template, make_response
 from . import BuildWeb_blueprint
 from .bundle_info_deal import *
 from .shader_variants_count_deal import *
 from .dlc_info_deal import *
+from .bundle_trend_deal import *
 from .common_task import check_requests_files
 from .project_setting import PROJECT_CODE
 from .common_task import *
+from .asset_query import QueryError, run_asset_query
+from .download_set_deal import get_download_set_index, validate_combinations
+from .batch_analysis import BatchAnalysisDeal, start_batch_analysis_job, validate_workers
+from .build_artifacts_deal import ArtifactUploadError, BuildArtifactsDeal, collect_request_artifacts
+from .bundle_cache import (get_cached_bundle_detail, get_build_table, get_bundle_group_stats, clear_bundle_cache,
+                           bundle_cache_info, cache_warmer, get_group_details, get_bundle_assets_by_name,
+                           iter_bundles_by_path)
 
-# 缓存加载的bundle详情数据
-@lru_cache(maxsize=10)
-def get_cached_bundle_detail(info_id):
-    """缓存bundle详情数据，减少重复加载"""
-    bundle_deal = BundleInfoDeal()
-    #print(bundle_deal.load_bundle_detail_info(info_id))
-    return bundle_deal.load_bundle_detail_info(info_id)
+
+@BuildWeb_blueprint.record_once
+def start_cache_warmup(state):
+    """应用注册蓝图后在后台预热最近的构建"""
+    if WARMUP_ON_STARTUP:
+        cache_warmer.start()
 
 # Bundle Info Routes
 @BuildWeb_blueprint.route('get_bundle_info_list')
@@ -28,6 +35,13 @@ def read_from_bundle_infos():
     platform = request.args.get('platform', "Android")
     schema = request.args.get('schema', 'Debug')
 
+    # 流式返回: 直接从Mongo游标逐条输出
+    if request.args.get('format') == 'ndjson':
+        fields = parse_fields(request.args.get('fields'))
+        # limit=0 会被Mongo当作不限制, 限定在 1..STREAM_MAX_RESULTS
+        limit = max(1, min(request.args.get('limit', STREAM_MAX_RESULTS, type=int), STREAM_MAX_RESULTS))
+        return ndjson_response(iter_bundle_info_list(platform, schema, fields, limit))
+
     info_list = get_bundle_info_list(platform, schema)
     print("Info list length:", len(info_list))
 
@@ -50,9 +64,45 @@ def get_bundle_info_list_test():
                            build_schemas=get_all_build_schemas(),
                            build_targets=get_all_build_targets())
 
+@BuildWeb_blueprint.route('get_bundle_trends')
+def get_bundle_trends():
+    """Get per group size trends over recent builds"""
+    platform = request.args.get('platform', "Android")
+    schema = request.args.get('schema', 'Debug')
+    since = request.args.get('since')
+    limit = request.args.get('limit', TREND_DEFAULT_LIMIT, type=int)
+    threshold = request.args.get('threshold', TREND_GROWTH_THRESHOLD, type=float)
+
+    try:
+        trend_deal = BundleTrendDeal()
+        trends = trend_deal.get_trends(platform, schema, since, limit, threshold)
+        return jsonify({
+            "status": "success",
+            "platform": platform,
+            "schema": schema,
+            "data": trends
+        })
+
+    except Exception as e:
+        print(f"Error getting bundle trends: {str(e)}")
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+@BuildWeb_blueprint.route('get_cache_metrics')
+def get_cache_metrics():
+    """Get build cache and warm-up metrics of this worker"""
+    return jsonify({
+        "status": "success",
+        "cache": bundle_cache_info(),
+        "warmup": cache_warmer.status
+    })
+
 @BuildWeb_blueprint.route('bundle_info_detail/<info_id>')
 def get_bundle_info_detail(info_id):
     """Get bundle info detail page"""
+    cache_warmer.prefetch_previous(info_id)
     response = make_response(render_template('bundle_info_detail.html', info_id=info_id))
     response.cache_control.max_age = 300  # 5 minutes cache
     return response
@@ -64,13 +114,8 @@ def get_bundle_group_bundles_size_and_count():
     info_id = request.args.get('info_id', 'l22_Android_Debug_202505191642')
 
     try:
-        # 使用缓存的数据
-        data = get_cached_bundle_detail(info_id)
-        bundle_deal = BundleInfoDeal()
-
-        # 只获取统计信息，不获取详细信息
-        # all_stats, internal_stats, suffix_stats = bundle_deal.group_process_bundles_new(data)
-        all_stats, internal_stats, suffix_stats = bundle_deal.calculate_stats_from_grouped_data(bundle_deal.group_bundles(data))
+        # 使用缓存的数据, 只获取统计信息，不获取详细信息
+        all_stats, internal_stats, suffix_stats = get_bundle_group_stats(info_id)
         print({
             "status": "success",
             "all_stats": all_stats,
@@ -95,6 +140,7 @@ def get_bundle_group_bundles_size_and_count():
 @BuildWeb_blueprint.route('bundle_group_details/<info_id>')
 def bundle_group_details(info_id):
     """Bundle分组详情页面"""
+    cache_warmer.prefetch_previous(info_id)
     response = make_response(render_template('bundle_info_group_detail.html', info_id=info_id))
     response.cache_control.max_age = 300  # 5 minutes cache
     return response
@@ -106,9 +152,7 @@ def get_enhanced_group_details():
     group_type = request.args.get('group_type')
 
     try:
-        data = get_cached_bundle_detail(info_id)
-        bundle_deal = BundleInfoDeal()
-        details = bundle_deal.get_enhanced_group_details(data, group_type)
+        details = get_group_details(info_id, group_type)
         print({
             "status": "success",
             "data": details
@@ -144,31 +188,13 @@ def get_bundle_assets():
 
     try:
         # 使用缓存的数据
-        data = get_cached_bundle_detail(info_id)
-
-        # 查找指定bundle
-        target_bundle = None
-        for bundle in data.get("Bundles", []):
-            if bundle.get("FileName") == bundle_name:
-                target_bundle = bundle
-                break
-
-        if not target_bundle:
+        assets = get_bundle_assets_by_name(info_id, bundle_name)
+        if assets is None:
             return jsonify({
                 "status": "error",
                 "message": f"Bundle '{bundle_name}' not found"
             }), 404
 
-        # 提取assets信息
-        assets = []
-        for asset in target_bundle.get("Assets", []):
-            assets.append({
-                "AssetPath": asset.get("AssetPath"),
-                "Hash": asset.get("Hash"),
-                "Size": asset.get("Size"),
-                "Type": asset.get("Type")
-            })
-
         return jsonify({
             "status": "success",
             "bundle_name": bundle_name,
@@ -184,7 +210,182 @@ def get_bundle_assets():
         }), 500
 
 
+@BuildWeb_blueprint.route('query_assets')
+def query_assets():
+    """Ad-hoc asset query: filter, sort, limit or aggregate over a cached build"""
+    info_id = request.args.get('info_id', 'l22_Android_Debug_202505191642')
+    filter_text = request.args.get('filter', '')
+    sort = request.args.get('sort')
+    limit = max(1, min(request.args.get('limit', QUERY_DEFAULT_LIMIT, type=int), STREAM_MAX_RESULTS))
+    group_by = request.args.get('group_by')
+    value_column = request.args.get('sum', 'size')
+
+    try:
+        table = get_build_table(info_id)
+        if table is None:
+            return jsonify({
+                "status": "error",
+                "message": f"Build '{info_id}' not found"
+            }), 404
+
+        result = run_asset_query(table, filter_text, sort, limit, group_by, value_column)
+        return jsonify(dict(result, status="success", info_id=info_id))
+
+    except QueryError as e:
+        return jsonify({
+            "status": "error",
+            "message": f"Invalid query: {str(e)}"
+        }), 400
+    except Exception as e:
+        print(f"Error querying assets: {str(e)}")
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+
+@BuildWeb_blueprint.route('calculate_download_sizes', methods=['POST'])
+def calculate_download_sizes():
+    """Download size of label/DLC group/design table combinations, evaluated in one batch"""
+    request_data = request.get_json(silent=True) or {}
+    info_id = request_data.get('info_id', '')
+    combinations = request_data.get('combinations', [])
+    include_internal = request_data.get('include_internal', False)
+
+    if not info_id:
+        return jsonify({
+            "status": "error",
+            "message": "info_id and a list of combinations are required"
+        }), 400
+    # 与单个组合的校验一致: "false" 等非布尔值不会被当作True
+    if not isinstance(include_internal, bool):
+        return jsonify({
+            "status": "error",
+            "message": "include_internal must be a boolean"
+        }), 400
+
+    # 逐条校验, 返回每个无效组合的错误
+    errors = validate_combinations(combinations)
+    if errors:
+        return jsonify({
+            "status": "error",
+            "message": f"{len(errors)} invalid combination(s)",
+            "errors": errors
+        }), 400
+
+    try:
+        table = get_build_table(info_id)
+        if table is None:
+            return jsonify({
+                "status": "error",
+                "message": f"Build '{info_id}' not found"
+            }), 404
+
+        results = get_download_set_index(table).calculate_batch(combinations, include_internal)
+        return jsonify({
+            "status": "success",
+            "info_id": info_id,
+            "data": results
+        })
+
+    except Exception as e:
+        print(f"Error calculating download sizes: {str(e)}")
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+
+# Batch Analysis Routes
+@BuildWeb_blueprint.route('start_batch_analysis', methods=['POST'])
+def start_batch_analysis():
+    """Start (or resume) a batch analysis job over many builds in a process pool"""
+    request_data = request.get_json() or {}
+    job_id = request_data.get('job_id', '')
+    if not job_id:
+        return jsonify({
+            "status": "error",
+            "message": "job_id is required"
+        }), 400
+
+    try:
+        workers = request_data.get('workers')
+        try:
+            validate_workers(workers)
+        except ValueError as e:
+            return jsonify({
+                "status": "error",
+                "message": str(e)
+            }), 400
+
+        batch_deal = BatchAnalysisDeal()
+        info_ids = request_data.get('info_ids')
+        if not info_ids and batch_deal.get_job(job_id) is None:
+            info_ids = batch_deal.select_builds(request_data.get('platform'), request_data.get('schema'),
+                                                request_data.get('since'))
+        if not start_batch_analysis_job(job_id, info_ids, workers):
+            return jsonify({
+                "status": "error",
+                "message": f"Batch analysis '{job_id}' is already running"
+            }), 409
+
+        return jsonify({
+            "status": "success",
+            "job_id": job_id
+        }), 202
+
+    except Exception as e:
+        print(f"Error starting batch analysis: {str(e)}")
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+
+@BuildWeb_blueprint.route('get_batch_analysis_progress')
+def get_batch_analysis_progress():
+    """Progress of a batch analysis job"""
+    job_id = request.args.get('job_id', '')
+    job = BatchAnalysisDeal().get_job(job_id)
+    if job is None:
+        return jsonify({
+            "status": "error",
+            "message": f"Batch analysis '{job_id}' not found"
+        }), 404
+
+    return jsonify({
+        "status": "success",
+        "job_id": job_id,
+        "state": job["state"],
+        "total": len(job["info_ids"]),
+        "done": len(job["done"]),
+        "failed": job["failed"],
+        "results": job.get("results", []),
+        "updated_at": job["updated_at"]
+    })
+
+
 # Upload Routes
+def load_upload_json(data_bytes: bytes):
+    """Parse uploaded JSON, None if it is malformed"""
+    try:
+        return load_json_blob(data_bytes)
+    except ValueError as e:
+        print(f"Invalid JSON upload: {e}")
+        return None
+
+def invalid_json_response():
+    return jsonify({
+        "status": "error",
+        "message": "无效的JSON文件"
+    }), 400
+
+def is_same_bundle_upload(existing: dict, content_hash: str, data) -> bool:
+    """已有文档是否与本次上传内容相同; 旧文档没有content_hash时比较已存储的构建"""
+    if existing.get("content_hash"):
+        return existing["content_hash"] == content_hash
+    return data is not None and get_cached_bundle_detail(existing["project"]) == data
+
 @BuildWeb_blueprint.route('upload_to_bundle_info_json', methods=['POST'])
 def upload_to_bundle_info_json():
     """Upload bundle info JSON"""
@@ -197,23 +398,143 @@ def upload_to_bundle_info_json():
 
     info_id = f"{PROJECT_CODE}_{platform}_{schema}_{build_time}"
     bundle_deal = BundleInfoDeal()
-    bundle_deal.save_bundle_info_to_collection(info_id, build_time)
 
     success, file, filename = check_requests_files(request)
     if not success:
         return file
 
-    bundle_deal.save_bundle_info_to_gridfs(info_id, info_type, file)
+    # 读取时同步计算内容哈希, 重复上传同一份内容时直接返回
+    data_bytes, content_hash = read_and_hash(file)
+    data = None
+    existing = bundle_deal.get_bundle_info_doc(info_id)
+    if existing and not existing.get("content_hash"):
+        # 旧文档没有content_hash, 需要解析后与已存储的构建比较
+        data = load_upload_json(data_bytes)
+        if data is None:
+            return invalid_json_response()
+    if existing:
+        if is_same_bundle_upload(existing, content_hash, data):
+            return jsonify({
+                "status": "success",
+                "info_id": info_id,
+                "collection": BUNDLEINFO_COLLECTION,
+                "duplicate": True
+            }), 200
+        return jsonify({
+            "status": "failure",
+            "message": f'[DUPLICATE] Project "{info_id}" already exists with different content'
+        }), 409
 
-    # 清除缓存，确保下次获取最新数据
-    get_cached_bundle_detail.cache_clear()
+    if data is None:
+        data = load_upload_json(data_bytes)
+        if data is None:
+            return invalid_json_response()
+
+    # 汇总在写入前生成: 格式错误的构建直接拒绝, 不会留下没有汇总的文档
+    try:
+        rollup = build_upload_rollup(info_id, platform, schema, build_time, data)
+    except ValueError as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 400
+
+    # 补丁构建: 只存储相对基础构建的差异
+    patch = None
+    base_info_id = request.form.get('base_info_id')
+    if base_info_id:
+        base_data = get_cached_bundle_detail(base_info_id)
+        if base_data is None:
+            return jsonify({
+                "status": "failure",
+                "message": f'Base build "{base_info_id}" not found'
+            }), 404
+        delta = bundle_deal.build_patch_delta(base_data, data)
+        patch = bundle_deal.patch_summary(base_info_id, delta)
+        blob_bytes = json.dumps(delta, ensure_ascii=False).encode('utf-8')
+        blob_type, blob_hash = "patch_delta", hash_bytes(blob_bytes)
+    else:
+        blob_bytes, blob_type, blob_hash = data_bytes, info_type, content_hash
+    new_blob = find_gridfs_file_by_hash(blob_hash) is None
+    file_id = bundle_deal.save_bundle_info_to_gridfs(info_id, blob_type, blob_bytes, blob_hash)
+
+    success, msg = bundle_deal.save_bundle_info_to_collection(info_id, build_time, file_id, content_hash, patch)
+    if not success:
+        # 并发上传时另一个请求先写入了文档: 删除本次新写的文件, 内容相同则视为重复上传
+        if new_blob:
+            storage.delete(file_id)
+        existing = bundle_deal.get_bundle_info_doc(info_id)
+        if existing and is_same_bundle_upload(existing, content_hash, data):
+            return jsonify({
+                "status": "success",
+                "info_id": info_id,
+                "collection": BUNDLEINFO_COLLECTION,
+                "duplicate": True
+            }), 200
+        return jsonify({
+            "status": "failure",
+            "message": msg
+        }), 409
+    try:
+        BundleTrendDeal().save_rollup_to_collection(rollup)
+    except Exception as e:
+        # 汇总与文档一起写入: 汇总写入失败时撤销文档和新文件, 客户端可以重试
+        print(f"Saving rollup of {info_id} failed, rolling back: {e}")
+        db[BUNDLEINFO_COLLECTION].delete_one({"project": info_id, "content_hash": content_hash})
+        if new_blob:
+            storage.delete(file_id)
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+    # 已存储的构建不会再变化, 缓存无需清除, 只预热新构建
+    cache_warmer.prefetch(info_id)
 
     return jsonify({
         "status": "success",
         "info_id": info_id,
-        "collection": BUNDLEINFO_COLLECTION
+        "collection": BUNDLEINFO_COLLECTION,
+        "patch": patch
     }), 200
 
+@BuildWeb_blueprint.route('upload_build_artifacts', methods=['POST'])
+def upload_build_artifacts():
+    """Upload all artifacts of a build at once, as multipart fields or a zip archive"""
+    platform = request.form.get('platform')
+    schema = request.form.get('schema')
+    build_time = request.form.get('build_time')
+
+    print(f"Upload build artifacts: {platform}, {schema}, {build_time}")
+
+    if not platform or not schema or not build_time:
+        return jsonify({
+            "status": "error",
+            "message": "platform, schema and build_time are required"
+        }), 400
+
+    info_id = f"{PROJECT_CODE}_{platform}_{schema}_{build_time}"
+    try:
+        artifacts = collect_request_artifacts(request)
+        result = BuildArtifactsDeal(info_id, platform, schema, build_time).ingest(
+            artifacts, request.form.get('base_info_id'), get_cached_bundle_detail)
+    except ArtifactUploadError as e:
+        return jsonify({
+            "status": "failure",
+            "message": str(e)
+        }), e.status_code
+    except Exception as e:
+        print(f"Error uploading build artifacts: {str(e)}")
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+    if "bundle_info" in result["ingested"]:
+        cache_warmer.prefetch(info_id)
+
+    return jsonify(dict(result, status="success", info_id=info_id)), 200
+
 @BuildWeb_blueprint.route('upload_to_shader_variants_info_json', methods=['POST'])
 def upload_to_shader_variants_info_json():
     """Upload shader variants info JSON"""
@@ -229,11 +550,12 @@ def upload_to_shader_variants_info_json():
     if not success:
         return file
 
-    variants = json.load(file)
+    data_bytes, content_hash = read_and_hash(file)
+    variants = load_json_blob(data_bytes)
     print("Variants type:", type(variants))
 
     shader_deal = ShaderVariantsDeal()
-    shader_deal.save_shader_variants_to_collection(info_id, build_time, variants)
+    shader_deal.save_shader_variants_to_collection(info_id, build_time, variants, content_hash)
 
     return jsonify({
         "status": "success",
@@ -257,8 +579,9 @@ def upload_to_dlc_info_json():
     if not success:
         return file
 
-    dlcs = json.load(file)
-    success, doc_id = dlc_deal.save_dlc_info_to_collection(info_id, build_time, dlcs)
+    data_bytes, content_hash = read_and_hash(file)
+    dlcs = load_json_blob(data_bytes)
+    success, doc_id = dlc_deal.save_dlc_info_to_collection(info_id, build_time, dlcs, content_hash)
 
     return jsonify({
         "status": "success" if success else "failure",
@@ -282,8 +605,9 @@ def upload_to_dlc_design_map_info_json():
     if not success:
         return file
 
-    dlcs = json.load(file)
-    success, doc_id = dlc_deal.save_dlc_design_map_to_collection(info_id, build_time, dlcs)
+    data_bytes, content_hash = read_and_hash(file)
+    dlcs = load_json_blob(data_bytes)
+    success, doc_id = dlc_deal.save_dlc_design_map_to_collection(info_id, build_time, dlcs, content_hash)
 
     return jsonify({
         "status": "success" if success else "failure",
@@ -306,6 +630,54 @@ def get_shader_variants_count_info_json():
         "shader_variants_count_dict": shader_variants_count_dict
     }), 200
 
+@BuildWeb_blueprint.route('/get_shader_variants_diff', methods=['GET'])
+def get_shader_variants_diff():
+    """Diff shader variants of two (build, platform) pairs"""
+    base_info_id = request.args.get('base_info_id', '')
+    target_info_id = request.args.get('target_info_id', '')
+    base_platform = request.args.get('base_platform', 'Android')
+    target_platform = request.args.get('target_platform', base_platform)
+
+    if not base_info_id or not target_info_id:
+        return jsonify({
+            "status": "error",
+            "message": "base_info_id and target_info_id are required"
+        }), 400
+
+    # 不传limit时返回完整的差异; 传入时必须是正整数, 最多STREAM_MAX_RESULTS
+    limit_arg = request.args.get('limit')
+    try:
+        limit = parse_limit(limit_arg, STREAM_MAX_RESULTS, STREAM_MAX_RESULTS) if limit_arg else None
+    except ValueError as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 400
+
+    try:
+        diff = get_cached_shader_variants_diff(base_info_id, base_platform, target_info_id, target_platform)
+        if limit is not None:
+            diff = dict(diff, added=diff["added"][:limit], removed=diff["removed"][:limit],
+                        changed=diff["changed"][:limit])
+        return jsonify({
+            "status": "success",
+            "base": {"info_id": base_info_id, "platform": base_platform},
+            "target": {"info_id": target_info_id, "platform": target_platform},
+            "data": diff
+        }), 200
+
+    except ValueError as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 404
+    except Exception as e:
+        print(f"Error diffing shader variants: {str(e)}")
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
 @BuildWeb_blueprint.route('/get_dlc_infos_count_json', methods=['GET'])
 def get_dlc_infos_count_json():
     """Get DLC infos count"""
@@ -349,19 +721,28 @@ def find_asset_generator(data, target_path):
 @BuildWeb_blueprint.route('/search_from_bundle_detail', methods=['POST'])
 def search_from_bundle_detail():
     """Search from bundle detail"""
-    request_data = request.get_json()
+    request_data = request.get_json(silent=True) or {}
 
     info_id = request_data.get('info_id', '')
     path = request_data.get('path', '')
+    fields = parse_fields(request_data.get('fields'))
+    try:
+        limit = parse_limit(request_data.get('limit'), STREAM_MAX_RESULTS, STREAM_MAX_RESULTS)
+    except ValueError as e:
+        return jsonify({'data': [], "error": str(e)}), 400
 
     if not path or not info_id:
         return jsonify({'data': []})
 
     try:
         # 使用缓存的数据
-        data = get_cached_bundle_detail(info_id)
-        find_res = list(find_asset_generator(data, path))
-        return jsonify({'data': find_res})
+        find_res = (select_fields(bundle, fields)
+                    for bundle in islice(iter_bundles_by_path(info_id, path), limit))
+
+        # 流式返回: 边查找边输出, 不在内存中拼出完整结果
+        if request_data.get('format') == 'ndjson':
+            return ndjson_response(find_res)
+        return jsonify({'data': list(find_res)})
 
     except Exception as e:
         print(f"Error: {str(e)}")
@@ -0,0 +1,422 @@
+"""
+Load test of the BuildWeb blueprint with latency percentiles.
+
+Starts the app in a server subprocess (threaded werkzeug server against an
+in-memory Mongo stand-in, mongomock, seeded with synthetic builds), replays a
+weighted mix of dashboard requests at the given concurrency, and reports per
+route throughput and p50/p95/p99 latency, the peak RSS of the server process and
+the build cache hit rate. The server runs in its own process, so the client
+threads neither share its GIL nor count towards its RSS. Runs are seeded, so the
+numbers are comparable between releases.
+
+Peak RSS of one route can only be told apart by running that route alone:
+--per-route-rss replays each route of the mix on a fresh server afterwards.
+
+Usage:
+    python load_test.py --builds 4 --bundles 20000 --concurrency 16 --duration 30
+    python load_test.py --mix stats=3,group=2,assets=3,search=1 --output capacity.json
+    python load_test.py --mix stats=1,search=1 --per-route-rss --duration 10
+"""
+import argparse
+import http.client
+import io
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlencode
+
+import numpy as np
+
+URL_PREFIX = "/BuildWeb"
+GROUP_TYPES = ["Effect_Internal", "Effect_Remote", "UI", "UI_Atlas", "Scene", "Animation", "Audio", "Config"]
+ASSET_SUFFIXES = [".prefab", ".anim", ".fbx", ".png", ".mat", ".asset", ".bytes", ""]
+DEFAULT_MIX = "list=1,stats=3,group=2,assets=3,search=1"
+READY_PREFIX = "LOAD_TEST_READY "
+
+
+def patch_mongo(shared_cache: bool):
+    """用mongomock替换MongoClient, 必须在导入build_web之前调用"""
+    import mongomock
+    import mongomock.gridfs
+    import pymongo
+    mongomock.gridfs.enable_gridfs_integration()
+    pymongo.MongoClient = mongomock.MongoClient
+    os.environ["BUILD_WEB_STORAGE"] = "gridfs"
+    os.environ["BUILD_WEB_SHARED_CACHE"] = "1" if shared_cache else "0"
+
+
+def synthetic_build(rng: random.Random, bundle_count: int) -> dict:
+    """BundleInfos-shaped build with random groups, labels, DLC groups and assets"""
+    paths = [f"Assets/Res/{rng.choice(['Effect', 'UI', 'Art', 'Scene'])}/d{rng.randint(0, 200)}/"
+             f"f{i}{rng.choice(ASSET_SUFFIXES)}" for i in range(bundle_count * 2)]
+    bundles = []
+    for i in range(bundle_count):
+        file_name = str(10 ** 19 + i)
+        bundles.append({
+            "FileName": file_name,
+            "IsInternal": rng.random() < 0.4,
+            "IsBundle": True,
+            "GroupType": rng.choice(GROUP_TYPES),
+            "XXHash": rng.randint(0, 2 ** 32),
+            "Size": rng.randint(1000, 5_000_000),
+            "CombineName": str(rng.randint(0, 50)),
+            "CombineSize": 0,
+            "CombineOffset": 0,
+            "CombineHash": 0,
+            "DownloadVersion": 0,
+            "Labels": [rng.choice(["Internal", "4900000", "4900001", "4900006"]), file_name],
+            "DlcGroups": rng.sample(["dlc_a", "dlc_b", "dlc_c"], rng.randint(0, 2)),
+            "Assets": [{"AssetPath": rng.choice(paths), "Size": rng.randint(100, 2_000_000), "InnerSize": 0,
+                        "XXHash": rng.randint(0, 2 ** 32)} for _ in range(rng.randint(1, 6))]
+        })
+    label_infos = [{"Label": label, "DesignTables": ["MapConfig_Map"]} for label in ("4900000", "4900001")]
+    return {"Bundles": bundles, "LabelInfos": label_infos}
+
+
+def seed_builds(app, rng: random.Random, builds: int, bundle_count: int) -> list:
+    """Upload synthetic builds through the upload route, returns request targets of each build"""
+    client = app.test_client()
+    targets = []
+    for i in range(builds):
+        platform = ("Android", "iOS")[i % 2]
+        build_time = f"2025{i + 1:02d}010000"
+        data = synthetic_build(rng, bundle_count)
+        body = json.dumps(data).encode("utf-8")
+        response = client.post(f"{URL_PREFIX}/upload_to_bundle_info_json", data={
+            "platform": platform, "schema": "Debug", "build_time": build_time,
+            "file": (io.BytesIO(body), "BundleInfos_Normal.json")})
+        if response.status_code != 200:
+            raise RuntimeError(f"Seeding build {i} failed: {response.get_json()}")
+        sample = rng.sample(data["Bundles"], min(200, bundle_count))
+        targets.append({
+            "info_id": response.get_json()["info_id"],
+            "platform": platform,
+            "bundle_names": [bundle["FileName"] for bundle in sample],
+            "asset_paths": [bundle["Assets"][0]["AssetPath"] for bundle in sample]
+        })
+        print(f"Seeded {targets[-1]['info_id']}: {bundle_count} bundles, {len(body) / 1024 ** 2:.1f} MB")
+    return targets
+
+
+# 每种请求: 随机选择构建和参数, 返回 (method, path, json body)
+def request_list(rng, target):
+    return "GET", "get_bundle_info_list?" + urlencode({"platform": target["platform"], "schema": "Debug"}), None
+
+
+def request_stats(rng, target):
+    return "GET", "get_bundle_group_bundles_size_and_count?" + urlencode({"info_id": target["info_id"]}), None
+
+
+def request_group(rng, target):
+    return "GET", "get_grouped_bundle_details?" + urlencode(
+        {"info_id": target["info_id"], "group_type": rng.choice(GROUP_TYPES)}), None
+
+
+def request_assets(rng, target):
+    return "GET", "get_bundle_assets?" + urlencode(
+        {"info_id": target["info_id"], "bundle_name": rng.choice(target["bundle_names"])}), None
+
+
+def request_search(rng, target):
+    return "POST", "search_from_bundle_detail", {
+        "info_id": target["info_id"], "path": rng.choice(target["asset_paths"]), "limit": 100}
+
+
+def request_query(rng, target):
+    return "GET", "query_assets?" + urlencode({
+        "info_id": target["info_id"], "filter": f'group == "{rng.choice(GROUP_TYPES)}" and size > 1MB',
+        "sort": "-size", "limit": 50}), None
+
+
+SCENARIOS = {
+    "list": request_list,
+    "stats": request_stats,
+    "group": request_group,
+    "assets": request_assets,
+    "search": request_search,
+    "query": request_query,
+}
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise SystemExit(f"Unknown route in mix: {name}, expected one of {', '.join(SCENARIOS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def read_rss(pid: int):
+    """进程常驻内存(字节), 不支持/proc的平台返回None"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class LoadRecorder(object):
+    """Latencies per route, plus peak RSS of the server process"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.peak_rss = None
+        self.stopped = threading.Event()
+
+    def end(self, route: str, latency: float, ok: bool):
+        with self.lock:
+            self.latencies[route].append(latency)
+            if not ok:
+                self.errors[route] += 1
+
+    def sample_rss(self, pid: int, interval=0.01):
+        while not self.stopped.wait(interval):
+            rss = read_rss(pid)
+            if rss is None:
+                return
+            self.peak_rss = max(self.peak_rss or 0, rss)
+
+
+def run_client(port: int, targets: list, mix: dict, recorder: LoadRecorder, deadline: float, seed: int):
+    rng = random.Random(seed)
+    routes = list(mix)
+    weights = [mix[route] for route in routes]
+    while time.time() < deadline:
+        route = rng.choices(routes, weights)[0]
+        method, path, body = SCENARIOS[route](rng, rng.choice(targets))
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        start = time.perf_counter()
+        ok = False
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+            connection.request(method, f"{URL_PREFIX}/{path}",
+                               body=json.dumps(body) if body is not None else None, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            ok = response.status < 400
+            connection.close()
+        except (OSError, http.client.HTTPException) as e:
+            print(f"{route} request failed: {e}")
+        recorder.end(route, time.perf_counter() - start, ok)
+
+
+def get_cache_metrics(port: int) -> dict:
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    connection.request("GET", f"{URL_PREFIX}/get_cache_metrics")
+    metrics = json.loads(connection.getresponse().read())
+    connection.close()
+    return metrics["cache"]
+
+
+def cache_counts(cache: dict) -> tuple:
+    """(hits, misses) over the bundle detail cache and the build table cache (per process or shared)"""
+    hits, misses = cache["hits"], cache["misses"]
+    if cache.get("tables"):
+        hits += cache["tables"]["hits"]
+        misses += cache["tables"]["misses"]
+    if cache.get("shared"):
+        # 共享缓存中未命中的构建要么附加已发布的文件, 要么重新构建
+        hits += cache["shared"]["hits"]
+        misses += cache["shared"]["attaches"] + cache["shared"]["builds"]
+    return hits, misses
+
+
+def to_mb(size):
+    return round(size / 1024 ** 2, 1) if size is not None else None
+
+
+def summarize(recorder: LoadRecorder, elapsed: float, cache_before: dict, cache_after: dict) -> dict:
+    routes = {}
+    for route, latencies in sorted(recorder.latencies.items()):
+        latencies_ms = np.array(latencies) * 1000
+        p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+        routes[route] = {
+            "requests": len(latencies),
+            "errors": recorder.errors[route],
+            "throughput": round(len(latencies) / elapsed, 2),
+            "p50_ms": round(float(p50), 2),
+            "p95_ms": round(float(p95), 2),
+            "p99_ms": round(float(p99), 2)
+        }
+
+    hits_after, misses_after = cache_counts(cache_after)
+    hits_before, misses_before = cache_counts(cache_before)
+    hits, misses = hits_after - hits_before, misses_after - misses_before
+    total_requests = sum(route["requests"] for route in routes.values())
+    return {
+        "routes": routes,
+        "total": {
+            "requests": total_requests,
+            "errors": sum(route["errors"] for route in routes.values()),
+            "throughput": round(total_requests / elapsed, 2),
+            "server_peak_rss_mb": to_mb(recorder.peak_rss)
+        },
+        "cache": {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / (hits + misses), 4) if hits + misses else None,
+            "shared": cache_after.get("shared")
+        }
+    }
+
+
+def print_report(result: dict):
+    # 单路由RSS只在 --per-route-rss 单独运行各路由时才有意义
+    per_route_rss = "route_peak_rss_mb" in result
+    rss_header = f"{'alone RSS MB':>14}" if per_route_rss else ""
+    print(f"\n{'route':<10}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}"
+          f"{'p99 ms':>10}{rss_header}")
+    for route, stats in result["routes"].items():
+        rss = f"{str(result['route_peak_rss_mb'].get(route)):>14}" if per_route_rss else ""
+        print(f"{route:<10}{stats['requests']:>10}{stats['errors']:>8}{stats['throughput']:>10}{stats['p50_ms']:>10}"
+              f"{stats['p95_ms']:>10}{stats['p99_ms']:>10}{rss}")
+    total = result["total"]
+    print(f"{'total':<10}{total['requests']:>10}{total['errors']:>8}{total['throughput']:>10}")
+    peak_rss = total["server_peak_rss_mb"]
+    print(f"\nServer peak RSS: {f'{peak_rss} MB' if peak_rss is not None else 'n/a'}")
+    cache = result["cache"]
+    hit_rate = f"{cache['hit_rate']:.1%}" if cache["hit_rate"] is not None else "n/a"
+    print(f"\nBuild cache: {cache['hits']} hits, {cache['misses']} misses, hit rate {hit_rate}")
+
+
+class ServerProcess(object):
+    """App served from a subprocess (``load_test.py --serve``), seeded with synthetic builds"""
+    def __init__(self, args):
+        self.cache_dir = tempfile.mkdtemp(prefix="build_web_load_test_")
+        command = [sys.executable, "-u", os.path.abspath(__file__), "--serve",
+                   "--builds", str(args.builds), "--bundles", str(args.bundles), "--seed", str(args.seed)]
+        if args.no_shared_cache:
+            command.append("--no-shared-cache")
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                                        env=dict(os.environ, BUILD_WEB_SHARED_CACHE_DIR=self.cache_dir))
+        self.ready = None
+        self.log_tail = []
+        self.ready_event = threading.Event()
+        # 持续读取服务端输出, 避免管道写满阻塞服务进程
+        threading.Thread(target=self._drain_output, daemon=True).start()
+
+    def _drain_output(self):
+        for line in self.process.stdout:
+            line = line.rstrip("\n")
+            if line.startswith(READY_PREFIX):
+                self.ready = json.loads(line[len(READY_PREFIX):])
+                self.ready_event.set()
+            elif self.ready is None:
+                if line.startswith("Seeded"):
+                    print(line)
+                self.log_tail = (self.log_tail + [line])[-20:]
+        self.ready_event.set()
+
+    def wait_ready(self) -> dict:
+        self.ready_event.wait()
+        if self.ready is None:
+            raise RuntimeError("Server process exited before it was ready:\n" + "\n".join(self.log_tail))
+        return self.ready
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+
+def serve(args):
+    """--serve: 在子进程中导入app, 写入构建后提供服务, 就绪时输出端口和请求目标"""
+    patch_mongo(shared_cache=not args.no_shared_cache)
+    from werkzeug.serving import make_server
+    from app import app
+
+    targets = seed_builds(app, random.Random(args.seed), args.builds, args.bundles)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    print(READY_PREFIX + json.dumps({"port": server.server_port, "targets": targets}), flush=True)
+    server.serve_forever()
+
+
+def run_load(args, mix: dict) -> dict:
+    """Start a fresh server, replay the mix against it and summarize"""
+    server = ServerProcess(args)
+    try:
+        ready = server.wait_ready()
+        port, targets = ready["port"], ready["targets"]
+        print(f"Serving on port {port} (pid {server.process.pid}), {args.concurrency} clients, mix {mix}")
+
+        def replay(seconds: float, recorder: LoadRecorder):
+            deadline = time.time() + seconds
+            clients = [threading.Thread(target=run_client,
+                                        args=(port, targets, mix, recorder, deadline, args.seed * 1000 + i))
+                       for i in range(args.concurrency)]
+            for client in clients:
+                client.start()
+            for client in clients:
+                client.join()
+
+        if args.warmup:
+            replay(args.warmup, LoadRecorder())
+
+        recorder = LoadRecorder()
+        sampler = threading.Thread(target=recorder.sample_rss, args=(server.process.pid,), daemon=True)
+        cache_before = get_cache_metrics(port)
+        sampler.start()
+        start = time.time()
+        replay(args.duration, recorder)
+        elapsed = time.time() - start
+        recorder.stopped.set()
+        sampler.join()
+        cache_after = get_cache_metrics(port)
+    finally:
+        server.stop()
+    return summarize(recorder, elapsed, cache_before, cache_after)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the BuildWeb blueprint against synthetic builds")
+    parser.add_argument("--builds", type=int, default=4, help="number of synthetic builds to seed")
+    parser.add_argument("--bundles", type=int, default=20000, help="bundles per synthetic build")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent clients")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to replay requests")
+    parser.add_argument("--warmup", type=float, default=0, help="seconds of untimed requests before measuring")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"weighted routes, default {DEFAULT_MIX}")
+    parser.add_argument("--no-shared-cache", action="store_true", help="use only the per-process build cache")
+    parser.add_argument("--per-route-rss", action="store_true",
+                        help="also replay each route alone on a fresh server to measure its peak RSS")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        return serve(args)
+    mix = parse_mix(args.mix)
+
+    result = run_load(args, mix)
+    if args.per_route_rss:
+        result["route_peak_rss_mb"] = {}
+        for route in mix:
+            print(f"Replaying {route} alone")
+            result["route_peak_rss_mb"][route] = run_load(args, {route: 1})["total"]["server_peak_rss_mb"]
+    result["config"] = dict(vars(args), mix=mix)
+    del result["config"]["serve"]
+    print_report(result)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())